@@ -8,16 +8,16 @@ Changes to the system are logged.
 
 import codecs
 from collections import namedtuple
-from glob import glob
+from glob import iglob
 import os
 from os.path import join, exists, realpath, expanduser
 from pathlib import Path
-import pexpect
 from queue import Queue, Empty
 from sys import exit, stdout, stderr, platform
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, TimeoutExpired
 from shutil import copyfile, rmtree, copytree, move, which
 import shlex
+import stat
 import time
 import tarfile
 from threading import Thread
@@ -56,11 +56,11 @@ def rmdir(dn):
 
 
 def file_matches(patterns):
-    result = []
+    """
+    Iterate over the paths matching any of the glob patterns.
+    """
     for pattern in patterns:
-        matches = glob(expanduser(pattern.strip()))
-        result.extend(matches)
-    return result
+        yield from iglob(expanduser(pattern.strip()))
 
 
 def file_exists(path):
@@ -128,23 +128,43 @@ def file_extract(archive, env, cwd="."):
 
     if path.suffix == ".zip":
         LOGGER.debug("Extracting {0} to {1}".format(archive, cwd))
-        if platform == "win32":
-            # This won't work on Unix/OSX, because Android NDK (for example)
-            # relies on non-standard handling of file permissions and symbolic
-            # links that Python's zipfile doesn't support.
-            # Windows doesn't support them either.
-            with ZipFile(path, "r") as compressed_file:
+        with ZipFile(path, "r") as compressed_file:
+            if platform == "win32":
+                # Windows supports neither the Unix permissions nor the
+                # symbolic links stored in the archive.
                 compressed_file.extractall(cwd)
-            return
-        else:
-            # This won't work on Windows, because there is no unzip command
-            # there
-            return_code = cmd(
-                ["unzip", "-q", join(cwd, archive)], cwd=cwd, env=env
-            ).return_code
-            if return_code != 0:
-                raise BuildozerCommandException(
-                    "Unzip gave bad return code: {}".format(return_code))
+                return
+            # Python's zipfile doesn't restore symbolic links, which the
+            # Android NDK (for example) relies on. Only archives without
+            # links are extracted in-process, with their permissions
+            # restored afterwards.
+            infos = compressed_file.infolist()
+            if not any(stat.S_ISLNK(info.external_attr >> 16)
+                       for info in infos):
+                dir_modes = []
+                for info in infos:
+                    extracted = compressed_file.extract(info, cwd)
+                    mode = (info.external_attr >> 16) & 0o777
+                    if not mode:
+                        continue
+                    if info.is_dir():
+                        # A read-only directory would stop its own members
+                        # being extracted, so (like unzip) set those last.
+                        dir_modes.append((extracted, mode))
+                    else:
+                        os.chmod(extracted, mode)
+                # Deepest first, so a parent's mode can't block its children.
+                for extracted, mode in reversed(dir_modes):
+                    os.chmod(extracted, mode)
+                return
+        # This won't work on Windows, because there is no unzip command
+        # there
+        return_code = cmd(
+            ["unzip", "-q", join(cwd, archive)], cwd=cwd, env=env
+        ).return_code
+        if return_code != 0:
+            raise BuildozerCommandException(
+                "Unzip gave bad return code: {}".format(return_code))
         return
 
     if path.suffix == ".bin":
@@ -187,6 +207,10 @@ class _StreamReader:
         self._queue = Queue()
         self._completed_count = 0  # How many streams have been finished.
         for stream, id in [(stdout_, "out"), (stderr_, "err")]:
+            if stream is None:
+                # Not piped to us; nothing to read.
+                self._completed_count += 1
+                continue
             t = Thread(target=self._fill_queue, args=(stream, id), daemon=True)
             t.start()
 
@@ -208,6 +232,10 @@ class _StreamReader:
                 self._queue.put((line, id))
         self._queue.put("completed")
 
+    @property
+    def completed(self):
+        return self._completed_count >= 2
+
     def read(self, timeout=None):
         """
         returns a tuple (stdin_output, stderr_output)
@@ -256,6 +284,10 @@ def cmd(
     run_condition=None,
     show_output=None,
     quiet=False,
+    stdin=None,
+    close_fds=True,
+    stdout_file=None,
+    stderr_file=None,
 ) -> CommandResult:
     """run a command as a subprocess, with the ability to display progress
     and to abort the process early.
@@ -281,6 +313,20 @@ def cmd(
     quiet parameter reduces logging; useful to keep passwords in command lines
     out of the log.
 
+    If stdin is provided, those bytes are written to the subprocess's standard
+    input, which is then closed. Useful to answer prompts non-interactively.
+
+    close_fds can be set to false for trusted tools (adb, pip, p4a) that don't
+    care about inherited file descriptors; it lets the subprocess be spawned
+    without closing every descriptor of the parent first. Buildozer opens no
+    inheritable descriptors besides stdio, so nothing else leaks.
+
+    If stdout_file is provided (an open file or sys.stdout), the subprocess
+    writes its standard output straight to it instead of through a pipe, so
+    long, chatty output is not pumped line by line through Python. That
+    output is then neither echoed nor returned. stderr_file does the same
+    for standard error; subprocess.DEVNULL discards it without a pipe.
+
     The env parameter is deliberately not optional, to ensure it is considered
     during the migration to use this library. Once completed, it can return
     to having a default of None.
@@ -297,15 +343,28 @@ def cmd(
         LOGGER.debug("Run {0!r} ...".format(" ".join(command)))
         LOGGER.debug("Cwd {}".format(cwd))
 
+    if hasattr(stdout_file, "flush"):
+        # Anything buffered must come out before the subprocess' output.
+        stdout_file.flush()
+
     process = Popen(
         command,
         env=env,
-        stdout=PIPE,
-        stderr=PIPE,
-        close_fds=True,
+        stdin=None if stdin is None else PIPE,
+        stdout=PIPE if stdout_file is None else stdout_file,
+        stderr=PIPE if stderr_file is None else stderr_file,
+        close_fds=close_fds,
         cwd=cwd,
     )
 
+    if stdin is not None:
+        try:
+            process.stdin.write(stdin)
+            process.stdin.close()
+        except BrokenPipeError:
+            # The process exited without reading all of its input.
+            pass
+
     reader = _StreamReader(process.stdout, process.stderr)
 
     ret_stdout = [] if get_stdout else None
@@ -333,6 +392,13 @@ def cmd(
             # time to terminate the process.
             process.terminate()
             # keep looping to get the rest of the output.
+        elif reader.completed:
+            # Nothing (left) to read, e.g. both streams go straight to files;
+            # wait on the process rather than spinning on poll().
+            try:
+                process.wait(timeout=1)
+            except TimeoutExpired:
+                pass
 
     if process.returncode != 0 and break_on_error:
         _command_fail(command, env, process.returncode)
@@ -381,22 +447,32 @@ def cmd_expect(command, env, **kwargs):
     LOGGER.debug("Cwd {}".format(kwargs.get("cwd")))
 
     assert platform != "win32", "pexpect.spawn is not available on Windows."
+    # imported here, as pulling in pexpect and its pty machinery is only
+    # needed by the few interactive commands
+    import pexpect
     return pexpect.spawn(shlex.join(command), env=env, encoding="utf-8", **kwargs)
 
 
-def _report_download_progress(bytes_read, total_size):
+def _report_download_progress(filename, bytes_read, total_size):
     if total_size <= 0:  # Sometimes we don't get told.
         progression = "{0} bytes".format(bytes_read)
     else:
         progression = "{0:.2f}%".format(100.0 * bytes_read / total_size)
     if "CI" not in os.environ:
-        # Write over and over on same line.
-        stdout.write("- Download {}\r".format(progression))
+        # Write over and over on same line. Several downloads can share that
+        # line, so say which one this is, and pad to cover a longer line.
+        line = "- Download {} {}".format(os.path.basename(filename), progression)
+        stdout.write("{:<79}\r".format(line))
         stdout.flush()
 
 
-def download(url, filename, cwd=None):
-    """Download the file at url/filename to filename"""
+def download(url, filename, cwd=None, cancel=None):
+    """Download the file at url/filename to filename
+
+    If cancel (a threading.Event) gets set, the download stops at the next
+    block, the partial file is removed and BuildozerCommandException is
+    raised.
+    """
     url = url + str(filename)
 
     LOGGER.debug("Downloading {0}".format(url))
@@ -421,12 +497,18 @@ def download(url, filename, cwd=None):
         with open(filename, "wb") as out_file:
             # Read in blocks, so we can give a progress bar.
             while True:
+                if cancel is not None and cancel.is_set():
+                    break
                 block = response.read(block_size)
                 if not block:
                     break
                 out_file.write(block)
                 bytes_read += len(block)
 
-                _report_download_progress(bytes_read, total_size)
+                _report_download_progress(filename, bytes_read, total_size)
 
+    if cancel is not None and cancel.is_set():
+        file_remove(filename)
+        raise BuildozerCommandException(
+            "Download of {} cancelled".format(url))
     return filename
@@ -137,6 +137,11 @@ fullscreen = 0
 # when an update is due and you just want to test/build your package
 # android.skip_update = False
 
+# (bool) If True, always run python-for-android, even when none of the
+# build inputs changed since the last build. Can be given for a single
+# run as APP_ANDROID_FORCE_BUILD=1
+# android.force_build = False
+
 # (bool) If True, then automatically accept SDK license
 # agreements. This is intended for automation only. If set to False,
 # the default, you will be shown the license when first running
@@ -278,11 +283,16 @@ fullscreen = 0
 #android.uses_library =
 
 # (str) Android logcat filters to use
+# (defaults to the app's python, SDL and crash logs only)
 #android.logcat_filters = *:S python:D
 
 # (bool) Android logcat only display log for activity's pid
 #android.logcat_pid_only = False
 
+# (bool) Skip the logcat command entirely, e.g. in scripted
+# "deploy run logcat" invocations
+#android.logcat_disabled = False
+
 # (str) Android additional adb arguments
 #android.adb_args = -H host.docker.internal
 
@@ -21,21 +21,28 @@ APACHE_ANT_VERSION = '1.9.4'
 DEFAULT_ANDROID_NDK_VERSION = '17c'
 
 import ast
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cached_property, lru_cache
+from glob import iglob
+import hashlib
+import importlib.metadata as importlib_metadata
 import io
+from itertools import chain
 from os import environ
-from os.path import exists, join, realpath, expanduser, basename, relpath
+from os.path import (
+    abspath, exists, join, realpath, expanduser, basename, relpath)
+from pathlib import Path
 from platform import architecture
 import re
 import shlex
 from shutil import which
+from subprocess import DEVNULL
 from sys import platform, executable
+from threading import Event
 from time import sleep
 import traceback
 
-import packaging.version
-import pexpect
-
+from buildozer import __version__
 import buildozer.buildops as buildops
 from buildozer.exceptions import BuildozerException
 from buildozer.logger import USE_COLOR
@@ -54,12 +61,176 @@ DEFAULT_SDK_TAG = '6514223'
 
 DEFAULT_ARCHS = ['arm64-v8a', 'armeabi-v7a']
 
+# Logcat filters used when android.logcat_filters is not set: silence
+# everything but the app's own tags and crashes, so the device does not
+# stream the whole framework's log over adb.
+DEFAULT_LOGCAT_FILTERS = [
+    '-v', 'brief',
+    '*:S', 'python:D', 'PythonActivity:D', 'SDL:D', 'AndroidRuntime:E']
+
 MSG_P4A_RECOMMENDED_NDK_ERROR = (
     "WARNING: Unable to find recommended Android NDK for current "
     "installation of python-for-android, defaulting to the default "
     "version r{android_ndk}".format(android_ndk=DEFAULT_ANDROID_NDK_VERSION)
 )
 
+_IS_WIN = platform in ('win32', 'cygwin')
+_IS_DARWIN = platform == 'darwin'
+_IS_LINUX = platform.startswith('linux')
+_IS_FREEBSD = platform.startswith('freebsd')
+
+# the (possibly quoted) recommended version in p4a's recommendations.py
+_NDK_RECOMMENDATION_RE = re.compile(
+    r"^RECOMMENDED_NDK_VERSION\s*=\s*[\"']?([^\"'\s]+)", re.M)
+
+# the major number of an NDK version such as "25b"
+_NDK_MAJOR_RE = re.compile(r"(\d+)")
+
+# build-tools package versions in the output of `sdkmanager --list`
+_BUILD_TOOLS_RE = re.compile(r"^\s*build-tools;(\S+)", re.M)
+
+
+@lru_cache(maxsize=1024)
+def _canon(path):
+    return realpath(expanduser(path))
+
+
+def _find_install_reqs(setup):
+    # the first literal assigned to install_reqs in p4a's setup.py
+    for node in ast.walk(ast.parse(setup)):
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == 'install_reqs'
+                for target in node.targets):
+            return ast.literal_eval(node.value)
+    return None
+
+
+def _requirement_satisfied(requirement):
+    # whether the running interpreter already has a distribution matching
+    # the requirement string
+    from packaging.requirements import InvalidRequirement, Requirement
+    try:
+        req = Requirement(requirement)
+    except InvalidRequirement:
+        return False
+    if req.marker is not None and not req.marker.evaluate():
+        return True
+    if req.extras:
+        # the extras' own dependencies aren't checked, so leave it to pip
+        return False
+    try:
+        version = importlib_metadata.version(req.name)
+    except importlib_metadata.PackageNotFoundError:
+        return False
+    return req.specifier.contains(version, prereleases=True)
+
+
+def _emit_flags(cmd, cfg, spec):
+    """
+    Extend cmd with the p4a arguments described by spec, read from cfg.
+
+    Kinds: 'bool' adds the bare flag when the option is true, 'value' adds
+    the flag and the value when set, 'path' the same with the value
+    canonicalised, 'list' and 'paths' add the flag once per item, and
+    'list=' adds flag=item once per item.
+    """
+    for flag, token, kind, default in spec:
+        if kind == 'bool':
+            if cfg.getbooldefault(token, default):
+                cmd.append(flag)
+        elif kind == 'value' or kind == 'path':
+            value = cfg.getdefault(token, default)
+            if value:
+                cmd.extend((flag, _canon(value) if kind == 'path' else value))
+        elif kind == 'list':
+            cmd.extend(chain.from_iterable(
+                (flag, value) for value in cfg.getlist(token, default)))
+        elif kind == 'paths':
+            cmd.extend(chain.from_iterable(
+                (flag, _canon(value)) for value in cfg.getlist(token, default)))
+        elif kind == 'list=':
+            cmd.extend('{}={}'.format(flag, value)
+                       for value in cfg.getlist(token, default))
+        else:
+            raise ValueError('Unknown p4a flag kind: {}'.format(kind))
+
+
+def _hash_file(h, fn):
+    # in fixed-size chunks, so large assets and libraries aren't read whole
+    with open(fn, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            h.update(chunk)
+
+
+def _hash_path(h, path):
+    # feed the names and content of a file, or of a whole tree, into h
+    h.update(path.encode('utf-8', 'surrogateescape'))
+    if os.path.isfile(path):
+        _hash_file(h, path)
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fn in sorted(files):
+            fn = join(root, fn)
+            h.update(relpath(fn, path).encode('utf-8', 'surrogateescape'))
+            if os.path.isfile(fn):
+                _hash_file(h, fn)
+
+
+def _read_text(path):
+    return Path(path).read_text(encoding='utf-8')
+
+
+@lru_cache(maxsize=None)
+def _which(name):
+    return which(name)
+
+
+@lru_cache(maxsize=None)
+def _zlib_header_present():
+    return buildops.file_exists('/usr/include/zlib.h')
+
+
+class _AppConfig:
+    """
+    Snapshot of the [app] section of the spec, read in a single pass.
+
+    Mirrors the SpecParser getters used while building, without going
+    back through ConfigParser for every token.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._items = dict(config.items('app'))
+
+    def items(self):
+        return self._items.items()
+
+    def getdefault(self, token, default=None):
+        return self._items.get(token, default)
+
+    def getbooldefault(self, token, default=False):
+        if token not in self._items:
+            return default
+        value = self._items[token]
+        if value.lower() not in self._config.BOOLEAN_STATES:
+            raise ValueError('Not a boolean: %s' % value)
+        return self._config.BOOLEAN_STATES[value.lower()]
+
+    def getlist(self, token, default=None):
+        # lists given in their own [app:token] section are left to the parser
+        if self._config.has_section('app:{}'.format(token)):
+            return self._config.getlist('app', token, default)
+        values = self._items.get(token)
+        if values is None:
+            return default
+        return [x.strip() for x in values.split(',')]
+
+    def getlistvalues(self, token, default=None):
+        if self._config.has_section('app:{}'.format(token)):
+            return self._config.getlistvalues('app', token, default)
+        return self.getlist(token, default)
+
 
 class TargetAndroid(Target):
     targetname = 'android'
@@ -70,11 +241,33 @@ class TargetAndroid(Target):
     p4a_recommended_ndk_version = None
     extra_p4a_args = ''
 
+    # (flag, token, kind, default) of the [app] options passed straight on
+    # to p4a by execute_build_package; see _emit_flags for the kinds
+    _P4A_FLAG_SPEC = (
+        ('--presplash-color', 'android.presplash_color', 'value', None),
+        ('--service', 'services', 'list', []),
+        ('--home-app', 'android.home_app', 'bool', False),
+        ('--whitelist', 'android.whitelist_src', 'path', None),
+        ('--blacklist', 'android.blacklist_src', 'path', None),
+        ('--add-source', 'android.add_src', 'paths', []),
+        ('--add-aar', 'android.add_aars', 'paths', []),
+        ('--uses-library', 'android.uses_library', 'list=', []),
+        ('--depend', 'android.gradle_dependencies', 'list', []),
+        ('--manifest-placeholders', 'android.manifest_placeholders', 'value', None),
+    )
+
+    # characters dropped from the app title to name an ant-built apk
+    _APKTITLE_STRIP = str.maketrans('', '', '\'" ,')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.artifact_format = 'apk'
         self._serials = None
+        self._app_cfg_snapshot = None
+        # set to stop the other downloads once an installer has failed
+        self._install_cancel = None
+        self._package_name = None
 
         if self.buildozer.config.has_option(
             "app", "android.arch"
@@ -94,36 +287,36 @@ class TargetAndroid(Target):
         self._p4a_bootstrap = self.buildozer.config.getdefault(
             'app', 'p4a.bootstrap', 'sdl2')
         color = 'always' if USE_COLOR else 'never'
-        self.extra_p4a_args = [f"--color={color}", f"--storage-dir={self._build_dir}"]
 
         # minapi should match ndk-api, so can use the same default if
         # nothing is specified
         ndk_api = self.buildozer.config.getdefault(
             'app', 'android.ndk_api', self.android_minapi)
-        self.extra_p4a_args.append(f"--ndk-api={ndk_api}")
-
         hook = self.buildozer.config.getdefault("app", "p4a.hook", None)
-        if hook is not None:
-            self.extra_p4a_args.append(f"--hook={realpath(expanduser(hook))}")
         port = self.buildozer.config.getdefault('app', 'p4a.port', None)
-        if port is not None:
-            self.extra_p4a_args.append(f"--port={port}")
-
         setup_py = self.buildozer.config.getdefault('app', 'p4a.setup_py', False)
-        if setup_py:
-            self.extra_p4a_args.append("--use-setup-py")
-        else:
-            self.extra_p4a_args.append("--ignore-setup-py")
-
         activity_class_name = self.buildozer.config.getdefault(
             'app', 'android.activity_class_name', 'org.kivy.android.PythonActivity')
-        if activity_class_name != 'org.kivy.android.PythonActivity':
-            self.extra_p4a_args.append(f"--activity-class-name={activity_class_name}")
-
-        if self.logger.log_level >= 2:
-            self.extra_p4a_args.append("--debug")
-
         user_extra_p4a_args = self.buildozer.config.getdefault('app', 'p4a.extra_args', "")
+
+        # (flag, value) pairs; entries whose value is None are left out
+        p4a_flags = [
+            ("--color={}", color),
+            ("--storage-dir={}", self._build_dir),
+            ("--ndk-api={}", ndk_api),
+            ("--hook={}",
+             _canon(hook) if hook is not None else None),
+            ("--port={}", port),
+            ("--use-setup-py" if setup_py else "--ignore-setup-py", ""),
+            ("--activity-class-name={}",
+             activity_class_name
+             if activity_class_name != 'org.kivy.android.PythonActivity'
+             else None),
+            ("--debug", "" if self.logger.log_level >= 2 else None),
+        ]
+        self.extra_p4a_args = [
+            flag.format(value) for flag, value in p4a_flags
+            if value is not None]
         self.extra_p4a_args.extend(shlex.split(user_extra_p4a_args))
 
         self.warn_on_deprecated_tokens()
@@ -138,12 +331,13 @@ class TargetAndroid(Target):
 
     def _p4a(self, cmd, env, **kwargs):
         kwargs.setdefault('cwd', self.p4a_dir)
+        kwargs.setdefault('close_fds', False)
         return buildops.cmd(
             [*self._p4a_cmd, *cmd, *self.extra_p4a_args],
             env=env,
             **kwargs)
 
-    @property
+    @cached_property
     def p4a_dir(self):
         """The directory where python-for-android is/will be installed."""
 
@@ -177,20 +371,26 @@ class TargetAndroid(Target):
             self.logger.error(MSG_P4A_RECOMMENDED_NDK_ERROR)
             return ndk_version
 
-        for line in open(rec_file, "r"):
-            if line.startswith("RECOMMENDED_NDK_VERSION ="):
-                ndk_version = line.replace(
-                    "RECOMMENDED_NDK_VERSION =", "")
-                # clean version of unwanted characters
-                for i in {"'", '"', "\n", " "}:
-                    ndk_version = ndk_version.replace(i, "")
-                self.logger.info(
-                    "Recommended android's NDK version by p4a is: {}".format(
-                        ndk_version
-                    )
+        # the recommendation only changes when the p4a checkout does, so
+        # reuse the value found by a previous run if the file is untouched
+        cache_key = 'android:p4a_recommended_ndk'
+        cache_value = [rec_file, os.path.getmtime(rec_file)]
+        cached = self.buildozer.state.get(cache_key, None)
+        if cached and cached[:2] == cache_value:
+            self.p4a_recommended_ndk_version = cached[2]
+            return cached[2]
+
+        with open(rec_file, "r") as fd:
+            match = _NDK_RECOMMENDATION_RE.search(fd.read())
+        if match:
+            ndk_version = match.group(1)
+            self.logger.info(
+                "Recommended android's NDK version by p4a is: {}".format(
+                    ndk_version
                 )
-                self.p4a_recommended_ndk_version = ndk_version
-                break
+            )
+            self.p4a_recommended_ndk_version = ndk_version
+            self.buildozer.state[cache_key] = cache_value + [ndk_version]
         return ndk_version
 
     def _sdkmanager(self, *args, **kwargs):
@@ -207,47 +407,47 @@ class TargetAndroid(Target):
             kwargs['get_stdout'] = kwargs.get('get_stdout', True)
             return buildops.cmd(command, env=self.buildozer.environ, **kwargs)
 
-    @property
+    @cached_property
     def android_ndk_version(self):
         return self.buildozer.config.getdefault('app', 'android.ndk',
                                                 self.p4a_recommended_android_ndk)
 
-    @property
+    @cached_property
     def android_api(self):
         return self.buildozer.config.getdefault('app', 'android.api',
                                                 ANDROID_API)
 
-    @property
+    @cached_property
     def android_minapi(self):
         return self.buildozer.config.getdefault('app', 'android.minapi',
                                                 ANDROID_MINAPI)
 
-    @property
+    @cached_property
     def android_sdk_dir(self):
         directory = expanduser(self.buildozer.config.getdefault(
             'app', 'android.sdk_path', ''))
         if directory:
-            return realpath(directory)
+            return abspath(directory)
         return join(self.buildozer.global_platform_dir,
                     'android-sdk')
 
-    @property
+    @cached_property
     def android_ndk_dir(self):
         directory = expanduser(self.buildozer.config.getdefault(
             'app', 'android.ndk_path', ''))
         if directory:
-            return realpath(directory)
+            return abspath(directory)
         version = self.buildozer.config.getdefault('app', 'android.ndk',
                                                    self.android_ndk_version)
         return join(self.buildozer.global_platform_dir,
                     'android-ndk-r{0}'.format(version))
 
-    @property
+    @cached_property
     def apache_ant_dir(self):
         directory = expanduser(self.buildozer.config.getdefault(
             'app', 'android.ant_path', ''))
         if directory:
-            return realpath(directory)
+            return abspath(directory)
         version = self.buildozer.config.getdefault('app', 'android.ant',
                                                    APACHE_ANT_VERSION)
         return join(self.buildozer.global_platform_dir,
@@ -257,7 +457,7 @@ class TargetAndroid(Target):
     def sdkmanager_path(self):
         sdk_manager_name = (
             'sdkmanager.bat'
-            if platform in ('win32', 'cygwin')
+            if _IS_WIN
             else 'sdkmanager'
         )
         sdkmanager_path = join(
@@ -268,12 +468,22 @@ class TargetAndroid(Target):
                  ' installed'.format(sdkmanager_path)))
         return sdkmanager_path
 
-    @property
+    @cached_property
+    def _latest_build_tools(self):
+        return max(
+            os.listdir(join(self.android_sdk_dir, "build-tools")), key=parse)
+
+    @cached_property
+    def _copy_libs(self):
+        return self.buildozer.config.getbooldefault(
+            'app', 'android.copy_libs', True)
+
+    @cached_property
     def archs_snake(self):
         return "_".join(self._archs)
 
     def check_requirements(self):
-        if platform in ('win32', 'cygwin'):
+        if _IS_WIN:
             try:
                 self._set_win32_java_home()
             except:
@@ -289,16 +499,15 @@ class TargetAndroid(Target):
             self.keytool_cmd = self._locate_java('keytool')
 
             # Check for C header <zlib.h>.
-            is_debian_like = which("dpkg") is not None
-            if is_debian_like and \
-                    not buildops.file_exists('/usr/include/zlib.h'):
+            is_debian_like = _which("dpkg") is not None
+            if is_debian_like and not _zlib_header_present():
                 raise BuildozerException(
                     'zlib headers must be installed, '
                     'run: sudo apt-get install zlib1g-dev')
 
             # Override the OS which `sdkmanager` should download the packages for.
             # This enables download and use of Linux binaries on FreeBSD.
-            if platform.startswith('freebsd'):
+            if _IS_FREEBSD:
                 os.environ['REPO_OS_OVERRIDE'] = 'linux'
 
         # Adb arguments:
@@ -319,15 +528,48 @@ class TargetAndroid(Target):
         buildops.checkbin('Java compiler (javac)', self.javac_cmd)
         buildops.checkbin('Java keytool (keytool)', self.keytool_cmd)
 
+    def _p4a_head(self):
+        # commit of the p4a checkout, or None if it isn't a git checkout
+        result = buildops.cmd(
+            ["git", "rev-parse", "HEAD"],
+            get_stdout=True,
+            break_on_error=False,
+            show_output=False,
+            cwd=self.p4a_dir,
+            env=self.buildozer.environ)
+        return result.stdout.strip() if result.return_code == 0 else None
+
+    def _p4a_local_changes(self):
+        # uncommitted edits of a p4a.source_dir checkout: the diff against
+        # HEAD, and the untracked files
+        if not self.buildozer.config.getdefault('app', 'p4a.source_dir'):
+            return '', []
+        kwargs = dict(get_stdout=True, break_on_error=False,
+                      show_output=False, cwd=self.p4a_dir,
+                      env=self.buildozer.environ)
+        diff = buildops.cmd(["git", "diff", "HEAD"], **kwargs).stdout or ''
+        untracked = buildops.cmd(
+            ["git", "ls-files", "--others", "--exclude-standard"],
+            **kwargs).stdout or ''
+        return diff, [join(self.p4a_dir, fn) for fn in untracked.splitlines()]
+
     def _p4a_have_aab_support(self):
+        # the answer only changes with the p4a checkout, so remember it for
+        # the current commit rather than starting p4a each time
+        head = self._p4a_head()
+        cache_key = 'android:p4a_aab_support'
+        cached = self.buildozer.state.get(cache_key, None)
+        if head and cached and cached[0] == head:
+            return cached[1]
+
         returncode = self._p4a(
             ["aab", "-h"],
             break_on_error=False,
             env=self.buildozer.environ).return_code
-        if returncode == 0:
-            return True
-        else:
-            return False
+        have_aab_support = returncode == 0
+        if head:
+            self.buildozer.state[cache_key] = [head, have_aab_support]
+        return have_aab_support
 
     def _set_win32_java_home(self):
         if 'JAVA_HOME' in self.buildozer.environ:
@@ -352,26 +594,34 @@ class TargetAndroid(Target):
         else:
             return s
 
+    def _partial_dir(self, target_dir):
+        # installs are unpacked beside their final place and only moved there
+        # once complete, so an interrupted one isn't later taken as found
+        partial_dir = target_dir + '.partial'
+        buildops.rmdir(partial_dir)
+        buildops.mkdir(partial_dir)
+        return partial_dir
+
     def _install_apache_ant(self):
         ant_dir = self.apache_ant_dir
         if buildops.file_exists(ant_dir):
             self.logger.info('Apache ANT found at {0}'.format(ant_dir))
             return ant_dir
 
-        if not os.path.exists(ant_dir):
-            os.makedirs(ant_dir)
-
         self.logger.info('Android ANT is missing, downloading')
+        partial_dir = self._partial_dir(ant_dir)
         archive = 'apache-ant-{0}-bin.tar.gz'.format(APACHE_ANT_VERSION)
         url = 'https://archive.apache.org/dist/ant/binaries/'
         buildops.download(
             url,
             archive,
-            cwd=ant_dir)
+            cwd=partial_dir,
+            cancel=self._install_cancel)
         buildops.file_extract(
             archive,
-            cwd=ant_dir,
+            cwd=partial_dir,
             env=self.buildozer.environ)
+        buildops.rename(partial_dir, ant_dir)
         self.logger.info('Apache ANT installation done.')
         return ant_dir
 
@@ -382,29 +632,29 @@ class TargetAndroid(Target):
             return sdk_dir
 
         self.logger.info('Android SDK is missing, downloading')
-        if platform in ('win32', 'cygwin'):
+        if _IS_WIN:
             archive = 'commandlinetools-win-{}_latest.zip'.format(DEFAULT_SDK_TAG)
-        elif platform in ('darwin', ):
+        elif _IS_DARWIN:
             archive = 'commandlinetools-mac-{}_latest.zip'.format(DEFAULT_SDK_TAG)
-        elif platform.startswith('linux') or platform.startswith('freebsd'):
+        elif _IS_LINUX or _IS_FREEBSD:
             archive = 'commandlinetools-linux-{}_latest.zip'.format(DEFAULT_SDK_TAG)
         else:
             raise SystemError('Unsupported platform: {0}'.format(platform))
 
-        if not os.path.exists(sdk_dir):
-            os.makedirs(sdk_dir)
-
+        partial_dir = self._partial_dir(sdk_dir)
         url = 'https://dl.google.com/android/repository/'
         buildops.download(
             url,
             archive,
-            cwd=sdk_dir)
+            cwd=partial_dir,
+            cancel=self._install_cancel)
 
         self.logger.info('Unpacking Android SDK')
         buildops.file_extract(
             archive,
-            cwd=sdk_dir,
+            cwd=partial_dir,
             env=self.buildozer.environ)
+        buildops.rename(partial_dir, sdk_dir)
 
         self.logger.info('Android SDK tools base installation done.')
 
@@ -416,8 +666,7 @@ class TargetAndroid(Target):
             self.logger.info('Android NDK found at {0}'.format(ndk_dir))
             return ndk_dir
 
-        import re
-        _version = int(re.search(r'(\d+)', self.android_ndk_version).group(1))
+        _version = int(_NDK_MAJOR_RE.search(self.android_ndk_version).group(1))
 
         self.logger.info('Android NDK is missing, downloading')
         # Welcome to the NDK URL hell!
@@ -427,17 +676,13 @@ class TargetAndroid(Target):
         # from 10e on the URLs can be looked up at
         # https://developer.android.com/ndk/downloads/older_releases
 
-        is_darwin = platform == 'darwin'
-        is_linux = platform.startswith('linux')
-        is_freebsd = platform.startswith('freebsd')
-
-        if platform in ('win32', 'cygwin'):
+        if _IS_WIN:
             # Checking of 32/64 bits at Windows from: https://stackoverflow.com/a/1405971/798575
             import struct
             archive = 'android-ndk-r{0}-windows.zip'
             is_64 = (8 * struct.calcsize("P") == 64)
-        elif is_darwin or is_linux or is_freebsd:
-            _platform = 'linux' if (is_linux or is_freebsd) else 'darwin'
+        elif _IS_DARWIN or _IS_LINUX or _IS_FREEBSD:
+            _platform = 'linux' if (_IS_LINUX or _IS_FREEBSD) else 'darwin'
             if self.android_ndk_version in ['10c', '10d', '10e']:
                 ext = 'bin'
             elif _version <= 10:
@@ -460,40 +705,40 @@ class TargetAndroid(Target):
         else:
             url = 'https://dl.google.com/android/ndk/'
 
+        partial_dir = self._partial_dir(ndk_dir)
         buildops.download(url,
-                                archive,
-                                cwd=self.buildozer.global_platform_dir)
+                          archive,
+                          cwd=partial_dir,
+                          cancel=self._install_cancel)
 
         self.logger.info('Unpacking Android NDK')
         buildops.file_extract(
             archive,
-            cwd=self.buildozer.global_platform_dir,
+            cwd=partial_dir,
             env=self.buildozer.environ)
         buildops.rename(
             unpacked,
             ndk_dir,
-            cwd=self.buildozer.global_platform_dir)
+            cwd=partial_dir)
+        buildops.rmdir(partial_dir)
         self.logger.info('Android NDK installation done.')
         return ndk_dir
 
     def _android_list_build_tools_versions(self):
-        available_packages = self._sdkmanager('--list')
-
-        lines = available_packages[0].split('\n')
-
-        build_tools_versions = []
+        # listing the packages starts the sdkmanager JVM, so remember the
+        # result for as long as the same sdkmanager is installed, unless an
+        # update of the platform was explicitly asked for
+        sdkmanager_path = self.sdkmanager_path
+        cache_key = 'android:sdkmanager_build_tools'
+        cache_value = [sdkmanager_path, os.path.getmtime(sdkmanager_path)]
+        cached = self.buildozer.state.get(cache_key, None)
+        if cached and cached[:2] == cache_value and not self.platform_update:
+            return [parse(version) for version in cached[2]]
 
-        for line in lines:
-            if not line.strip().startswith('build-tools;'):
-                continue
-            package_name = line.strip().split(' ')[0]
-            assert package_name.count(';') == 1, (
-                'could not parse package "{}"'.format(package_name))
-            version = package_name.split(';')[1]
-
-            build_tools_versions.append(parse(version))
-
-        return build_tools_versions
+        available_packages = self._sdkmanager('--list')
+        build_tools_versions = _BUILD_TOOLS_RE.findall(available_packages[0])
+        self.buildozer.state[cache_key] = cache_value + [build_tools_versions]
+        return [parse(version) for version in build_tools_versions]
 
     def _android_update_sdk(self, *sdkmanager_commands):
         """Update the tools and package-tools if possible"""
@@ -502,34 +747,28 @@ class TargetAndroid(Target):
 
         kwargs = {}
         if auto_accept_license:
-            kwargs["return_child"] = True
+            # answer "y" to every license prompt sdkmanager may ask
+            kwargs['stdin'] = b"y\n" * 200
         else:
             kwargs['show_output'] = True
 
-        ret_child = self._sdkmanager(*sdkmanager_commands, **kwargs)
-
-        if auto_accept_license:
-            while ret_child.isalive():
-                pexp_match = ret_child.expect(
-                    ["(y/N)", pexpect.EOF, pexpect.TIMEOUT], timeout=300
-                )
-                if pexp_match == 0:
-                    ret_child.sendline("y")
+        self._sdkmanager(*sdkmanager_commands, **kwargs)
 
     def _read_version_subdir(self, *args):
         versions = []
-        if not os.path.exists(join(*args)):
-            self.logger.debug('build-tools folder not found {}'.format(join(
-                *args)))
+        path = join(*args)
+        if not os.path.exists(path):
+            self.logger.debug('build-tools folder not found {}'.format(path))
             return parse("0")
-        for v in os.listdir(join(*args)):
-            try:
-                versions.append(parse(v))
-            except:
-                pass
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    versions.append(parse(entry.name))
+                except:
+                    pass
         if not versions:
             self.logger.error(
-                'Unable to find the latest version for {}'.format(join(*args)))
+                'Unable to find the latest version for {}'.format(path))
             return parse("0")
         return max(versions)
 
@@ -550,30 +789,30 @@ class TargetAndroid(Target):
         # if any of these values change into the buildozer.spec, retry the
         # update
         cache_key = 'android:sdk_installation'
-        cache_value = [
-            self.android_api, self.android_minapi, self.android_ndk_version,
+        cache_value = hashlib.sha1(repr((
+            str(self.android_api), str(self.android_minapi),
+            str(self.android_ndk_version),
             self.android_sdk_dir, self.android_ndk_dir
-        ]
+        )).encode()).hexdigest()
         if self.buildozer.state.get(cache_key, None) == cache_value:
             return True
 
-        # 1. update the platform-tools package if needed
-
         skip_upd = self.buildozer.config.getbooldefault(
             'app', 'android.skip_update', False)
-
-        if not skip_upd:
-            self.logger.info('Installing/updating SDK platform tools if necessary')
-
-            # just calling sdkmanager with the items will install them if necessary
-            self._android_update_sdk('platform-tools')
-            self._android_update_sdk('--update')
-        else:
+        if skip_upd:
             self.logger.info('Skipping Android SDK update due to spec file setting')
             self.logger.info('Note: this also prevents installing missing '
                                 'SDK components')
 
-        # 2. install the latest build tool
+        # every sdkmanager call pays for a JVM startup, so collect the
+        # packages that are missing and install them all at once
+        packages = []
+
+        # 1. the platform-tools package, kept up to date by --update below
+        if not buildops.file_exists(join(self.android_sdk_dir, 'platform-tools')):
+            packages.append('platform-tools')
+
+        # 2. the latest build tool
         self.logger.info('Updating SDK build tools if necessary')
         installed_v_build_tools = self._read_version_subdir(self.android_sdk_dir,
                                                   'build-tools')
@@ -581,30 +820,38 @@ class TargetAndroid(Target):
         if not available_v_build_tools:
             self.logger.error('Did not find any build tools available to download')
 
-        latest_v_build_tools = sorted(available_v_build_tools)[-1]
+        latest_v_build_tools = max(available_v_build_tools)
         if latest_v_build_tools > installed_v_build_tools:
             if not skip_upd:
-                self._android_update_sdk(f"build-tools;{latest_v_build_tools}")
+                packages.append(f"build-tools;{latest_v_build_tools}")
                 installed_v_build_tools = latest_v_build_tools
             else:
                 self.logger.info(
                     'Skipping update to build tools {} due to spec setting'.format(
                         latest_v_build_tools))
 
-        # 2. check aidl can be run
-        self._check_aidl(installed_v_build_tools)
-
-        # 3. finally, install the android for the current api
-        self.logger.info('Downloading platform api target if necessary')
+        # 3. the android platform for the current api
         android_platform = join(self.android_sdk_dir, 'platforms', 'android-{}'.format(self.android_api))
         if not buildops.file_exists(android_platform):
             if not skip_upd:
-                self._sdkmanager(f"platforms;android-{self.android_api}")
+                packages.append(f"platforms;android-{self.android_api}")
             else:
                 self.logger.info(
                     'Skipping install API {} platform tools due to spec setting'.format(
                         self.android_api))
 
+        if not skip_upd:
+            if packages:
+                self.logger.info('Installing SDK packages: {}'.format(
+                    ', '.join(packages)))
+                self._android_update_sdk(*packages)
+                self.__dict__.pop('_latest_build_tools', None)
+            self.logger.info('Updating installed SDK packages if necessary')
+            self._android_update_sdk('--update')
+
+        # 4. check aidl can be run
+        self._check_aidl(installed_v_build_tools)
+
         self.logger.info('Android packages installation done.')
 
         self.buildozer.state[cache_key] = cache_value
@@ -612,8 +859,6 @@ class TargetAndroid(Target):
 
     def _check_aidl(self, v_build_tools):
         self.logger.debug('Check that aidl can be executed')
-        v_build_tools = self._read_version_subdir(self.android_sdk_dir,
-                                                  'build-tools')
         aidl_cmd = join(self.android_sdk_dir, 'build-tools',
                         str(v_build_tools), 'aidl')
         buildops.checkbin('Aidl', aidl_cmd)
@@ -639,10 +884,28 @@ class TargetAndroid(Target):
             raise BuildozerException()
 
     def install_platform(self):
-        self._install_p4a()
-        self._install_apache_ant()
-        self._install_android_sdk()
-        self._install_android_ndk()
+        # the installers are independent and mostly wait on downloads, so
+        # let them run side by side
+        self._install_cancel = Event()
+        executor = ThreadPoolExecutor(max_workers=3)
+        futures = [
+            executor.submit(self._install_p4a_and_android_ndk),
+            executor.submit(self._install_apache_ant),
+            executor.submit(self._install_android_sdk),
+        ]
+        try:
+            for future in as_completed(futures):
+                # re-raise any error from the installers
+                future.result()
+        except BaseException:
+            # stop the other downloads rather than finishing them first
+            self._install_cancel.set()
+            self.logger.info('Installation failed, waiting for the other '
+                             'downloads to stop')
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self._install_cancel = None
         self._install_android_packages()
 
         # ultimate configuration check.
@@ -655,14 +918,25 @@ class TargetAndroid(Target):
             )
             raise BuildozerException()
 
+        packages_dir = self.buildozer.global_packages_dir
+        sdk_dir, ndk_dir = self.android_sdk_dir, self.android_ndk_dir
+        api, minapi = self.android_api, self.android_minapi
         self.buildozer.environ.update({
-            'PACKAGES_PATH': self.buildozer.global_packages_dir,
-            'ANDROIDSDK': self.android_sdk_dir,
-            'ANDROIDNDK': self.android_ndk_dir,
-            'ANDROIDAPI': self.android_api,
-            'ANDROIDMINAPI': self.android_minapi,
+            'PACKAGES_PATH': packages_dir,
+            'ANDROIDSDK': sdk_dir,
+            'ANDROIDNDK': ndk_dir,
+            'ANDROIDAPI': api,
+            'ANDROIDMINAPI': minapi,
         })
 
+    def _install_p4a_and_android_ndk(self):
+        self._install_p4a()
+        # the NDK defaults to p4a's recommendation, which may only have
+        # become readable now that p4a is installed
+        self.__dict__.pop('android_ndk_version', None)
+        self.__dict__.pop('android_ndk_dir', None)
+        self._install_android_ndk()
+
     def _install_p4a(self):
         p4a_fork = self.buildozer.config.getdefault(
             'app', 'p4a.fork', self.p4a_fork
@@ -688,8 +962,14 @@ class TargetAndroid(Target):
                 self.logger.error('')
                 raise BuildozerException()
         else:
-            # check that url/branch has not been changed
-            if buildops.file_exists(p4a_dir):
+            # check that url/branch has not been changed, asking git only
+            # if they differ from the ones of the last install
+            cache_key = 'android:p4a_url_branch'
+            cache_value = [p4a_url, p4a_branch]
+            if (
+                buildops.file_exists(p4a_dir) and
+                self.buildozer.state.get(cache_key, None) != cache_value
+            ):
                 cur_url = buildops.cmd(
                     ["git", "config", "--get", "remote.origin.url"],
                     get_stdout=True,
@@ -697,11 +977,11 @@ class TargetAndroid(Target):
                     env=self.buildozer.environ
                 ).stdout.strip()
                 cur_branch = buildops.cmd(
-                    ["git", "branch", "-vv"],
+                    ["git", "rev-parse", "--abbrev-ref", "HEAD"],
                     get_stdout=True,
                     cwd=p4a_dir,
                     env=self.buildozer.environ
-                ).stdout.split()[1]
+                ).stdout.strip()
                 if any([cur_url != p4a_url, cur_branch != p4a_branch]):
                     self.logger.info(
                         f"Detected old url/branch ({cur_url}/{cur_branch}), deleting..."
@@ -751,18 +1031,27 @@ class TargetAndroid(Target):
                     ["git", "reset", "--hard", p4a_commit],
                     cwd=p4a_dir,
                     env=self.buildozer.environ)
+            self.buildozer.state[cache_key] = cache_value
 
         # also install dependencies (currently, only setup.py knows about it)
         # let's extract them.
         try:
             with open(join(self.p4a_dir, "setup.py")) as fd:
                 setup = fd.read()
-                deps = re.findall(r"^\s*install_reqs = (\[[^\]]*\])", setup, re.DOTALL | re.MULTILINE)[0]
-                deps = ast.literal_eval(deps)
         except IOError:
             self.logger.error('Failed to read python-for-android setup.py at {}'.format(
                 join(self.p4a_dir, 'setup.py')))
             sys.exit(1)
+        deps = _find_install_reqs(setup)
+        if deps is None:
+            self.logger.error('Failed to find install_reqs in python-for-android setup.py at {}'.format(
+                join(self.p4a_dir, 'setup.py')))
+            sys.exit(1)
+
+        # pip is only needed for the requirements not already met
+        deps = [dep for dep in deps if not _requirement_satisfied(dep)]
+        if not deps:
+            return
 
         # in virtualenv or conda env
         options = ["--user"]
@@ -770,6 +1059,7 @@ class TargetAndroid(Target):
             options = []
         buildops.cmd(
             [executable, "-m", "pip", "install", "-q", *options, *deps],
+            close_fds=False,
             env=self.buildozer.environ)
 
     def compile_platform(self):
@@ -780,18 +1070,17 @@ class TargetAndroid(Target):
         requirements = ','.join(app_requirements)
         options = []
 
-        source_dirs = {
-            'P4A_{}_DIR'.format(name[20:]): realpath(expanduser(value))
-            for name, value in self.buildozer.config.items('app')
-            if name.startswith('requirements.source.')
-        }
+        source_dirs = {}
+        for name, value in self._app_cfg.items():
+            if name.startswith('requirements.source.'):
+                source_dirs['P4A_{}_DIR'.format(name[20:])] = _canon(value)
         if source_dirs:
             self.buildozer.environ.update(source_dirs)
             self.logger.info('Using custom source dirs:\n    {}'.format(
                 '\n    '.join(['{} = {}'.format(k, v)
                                for k, v in source_dirs.items()])))
 
-        if self.buildozer.config.getbooldefault('app', 'android.copy_libs', True):
+        if self._copy_libs:
             options.append("--copy-libs")
         # support for recipes in a local directory within the project
         if local_recipes:
@@ -825,11 +1114,12 @@ class TargetAndroid(Target):
         return expected_dist_dir
 
     def get_local_recipes_dir(self):
-        local_recipes = self.buildozer.config.getdefault('app', 'p4a.local_recipes')
-        return realpath(expanduser(local_recipes)) if local_recipes else None
+        local_recipes = self._app_cfg.getdefault('p4a.local_recipes')
+        return _canon(local_recipes) if local_recipes else None
 
     def execute_build_package(self, build_cmd):
         # wrapper from previous old_toolchain to new toolchain
+        cfg = self._app_cfg
         dist_name = self.buildozer.config.get('app', 'package.name')
         local_recipes = self.get_local_recipes_dir()
         cmd = [self.artifact_format, "--bootstrap", self._p4a_bootstrap, "--dist_name", dist_name]
@@ -850,28 +1140,15 @@ class TargetAndroid(Target):
             else:
                 cmd.extend(args)
 
-        # support for presplash background color
-        presplash_color = self.buildozer.config.getdefault('app', 'android.presplash_color', None)
-        if presplash_color:
-            cmd.append('--presplash-color')
-            cmd.append("{}".format(presplash_color))
-
-        # support for services
-        services = self.buildozer.config.getlist('app', 'services', [])
-        for service in services:
-            cmd.append("--service")
-            cmd.append(service)
+        # simple options, see _P4A_FLAG_SPEC
+        _emit_flags(cmd, cfg, self._P4A_FLAG_SPEC)
 
         # support for copy-libs
-        if self.buildozer.config.getbooldefault('app', 'android.copy_libs', True):
+        if self._copy_libs:
             cmd.append("--copy-libs")
 
-        # Home-app usage
-        if self.buildozer.config.getbooldefault('app', 'android.home_app', False):
-            cmd.append("--home-app")
-
         # Enable display-cutout for Android devices
-        display_cutout = self.buildozer.config.getdefault('app', 'android.display_cutout', 'never').lower()
+        display_cutout = cfg.getdefault('android.display_cutout', 'never').lower()
         if display_cutout in {'default', 'shortedges'}:
             if display_cutout == 'shortedges':
                 display_cutout = 'shortEdges'
@@ -882,30 +1159,8 @@ class TargetAndroid(Target):
             cmd.append('--local-recipes')
             cmd.append(local_recipes)
 
-        # support for blacklist/whitelist filename
-        whitelist_src = self.buildozer.config.getdefault('app', 'android.whitelist_src', None)
-        blacklist_src = self.buildozer.config.getdefault('app', 'android.blacklist_src', None)
-        if whitelist_src:
-            cmd.append('--whitelist')
-            cmd.append(realpath(expanduser(whitelist_src)))
-        if blacklist_src:
-            cmd.append('--blacklist')
-            cmd.append(realpath(expanduser(blacklist_src)))
-
-        # support for java directory
-        javadirs = self.buildozer.config.getlist('app', 'android.add_src', [])
-        for javadir in javadirs:
-            cmd.append('--add-source')
-            cmd.append(realpath(expanduser(javadir)))
-
-        # support for aars
-        aars = self.buildozer.config.getlist('app', 'android.add_aars', [])
-        for aar in aars:
-            cmd.append('--add-aar')
-            cmd.append(realpath(expanduser(aar)))
-
         # support for assets folder
-        assets = self.buildozer.config.getlist('app', 'android.add_assets', [])
+        assets = cfg.getlist('android.add_assets', [])
         for asset in assets:
             cmd.append('--add-asset')
             if ':' in asset:
@@ -913,10 +1168,10 @@ class TargetAndroid(Target):
             else:
                 asset_src = asset
                 asset_dest = asset
-            cmd.append(realpath(expanduser(asset_src)) + ':' + asset_dest)
+            cmd.append(_canon(asset_src) + ':' + asset_dest)
 
         # support for res folder
-        resources = self.buildozer.config.getlist('app', 'android.add_resources', [])
+        resources = cfg.getlist('android.add_resources', [])
         for resource in resources:
             cmd.append('--add-resource')
             if ':' in resource:
@@ -924,54 +1179,35 @@ class TargetAndroid(Target):
             else:
                 resource_src = resource
                 resource_dest = ""
-            cmd.append(realpath(expanduser(resource_src)) + ':' + resource_dest)
-
-        # support for uses-lib
-        uses_library = self.buildozer.config.getlist(
-            'app', 'android.uses_library', '')
-        for lib in uses_library:
-            cmd.append('--uses-library={}'.format(lib))
+            cmd.append(_canon(resource_src) + ':' + resource_dest)
 
         # support for activity-class-name
-        activity_class_name = self.buildozer.config.getdefault(
-            'app', 'android.activity_class_name', 'org.kivy.android.PythonActivity')
+        activity_class_name = cfg.getdefault(
+            'android.activity_class_name', 'org.kivy.android.PythonActivity')
         if activity_class_name != 'org.kivy.android.PythonActivity':
             cmd.append('--activity-class-name={}'.format(activity_class_name))
 
         # support for service-class-name
-        service_class_name = self.buildozer.config.getdefault(
-            'app', 'android.service_class_name', 'org.kivy.android.PythonService')
+        service_class_name = cfg.getdefault(
+            'android.service_class_name', 'org.kivy.android.PythonService')
         if service_class_name != 'org.kivy.android.PythonService':
             cmd.append('--service-class-name={}'.format(service_class_name))
 
         # support for extra-manifest-xml
-        extra_manifest_xml = self.buildozer.config.getdefault(
-            'app', 'android.extra_manifest_xml', '')
+        extra_manifest_xml = cfg.getdefault('android.extra_manifest_xml', '')
         if extra_manifest_xml:
             cmd.append('--extra-manifest-xml')
-            cmd.append('{}'.format(open(extra_manifest_xml, 'rt').read()))
+            cmd.append(_read_text(extra_manifest_xml))
 
         # support for extra-manifest-application-arguments
-        extra_manifest_application_arguments = self.buildozer.config.getdefault(
-            'app', 'android.extra_manifest_application_arguments', '')
+        extra_manifest_application_arguments = cfg.getdefault(
+            'android.extra_manifest_application_arguments', '')
         if extra_manifest_application_arguments:
             cmd.append('--extra-manifest-application-arguments')
-            cmd.append('{}'.format(open(extra_manifest_application_arguments, 'rt').read()))
-
-        # support for gradle dependencies
-        gradle_dependencies = self.buildozer.config.getlist('app', 'android.gradle_dependencies', [])
-        for gradle_dependency in gradle_dependencies:
-            cmd.append('--depend')
-            cmd.append(gradle_dependency)
-
-        # support for manifestPlaceholders
-        manifest_placeholders = self.buildozer.config.getdefault('app', 'android.manifest_placeholders', None)
-        if manifest_placeholders:
-            cmd.append('--manifest-placeholders')
-            cmd.append("{}".format(manifest_placeholders))
+            cmd.append(_read_text(extra_manifest_application_arguments))
 
         # support disabling of byte compile for .py files
-        no_byte_compile = self.buildozer.config.getdefault('app', 'android.no-byte-compile-python', False)
+        no_byte_compile = cfg.getdefault('android.no-byte-compile-python', False)
         if no_byte_compile:
             cmd.append('--no-byte-compile-python')
 
@@ -1000,12 +1236,20 @@ class TargetAndroid(Target):
                 check = False
         return check
 
+    @property
+    def _app_cfg(self):
+        if self._app_cfg_snapshot is None:
+            self._app_cfg_snapshot = _AppConfig(self.buildozer.config)
+        return self._app_cfg_snapshot
+
     def cmd_debug(self, *args):
         self.artifact_format = self.buildozer.config.getdefault('app', 'android.debug_artifact', 'apk')
+        self._app_cfg_snapshot = None
         super().cmd_debug(*args)
 
     def cmd_release(self, *args):
         self.artifact_format = self.buildozer.config.getdefault('app', 'android.release_artifact', 'aab')
+        self._app_cfg_snapshot = None
         super().cmd_release(*args)
 
     def cmd_run(self, *args):
@@ -1013,6 +1257,7 @@ class TargetAndroid(Target):
             'app', 'android.entrypoint')
         if not entrypoint:
             self.buildozer.config.set('app', 'android.entrypoint', 'org.kivy.android.PythonActivity')
+            self._app_cfg_snapshot = None
 
         super().cmd_run(*args)
 
@@ -1021,35 +1266,38 @@ class TargetAndroid(Target):
 
         package = self._get_package()
 
-        # push on the device
-        for serial in self.serials:
-            self.buildozer.environ['ANDROID_SERIAL'] = serial
-            self.logger.info('Run on {}'.format(serial))
-            buildops.cmd(
-                [
-                    self.adb_executable,
-                    *self.adb_args,
-                    "shell",
-                    "am",
-                    "start",
-                    "-n",
-                    f"{package}/{entrypoint}",
-                    "-a",
-                    entrypoint,
-                ],
-                cwd=self.buildozer.global_platform_dir,
-                env=self.buildozer.environ
-            )
-        self.buildozer.environ.pop('ANDROID_SERIAL', None)
+        # start on the devices, all at once
+        self._on_each_serial(self._start_one, package, entrypoint)
 
-        while True:
-            if self._get_pid():
-                break
-            sleep(.1)
+        # `am start -W` already waited for the activity, so the process is
+        # normally there; back off between checks if it is not yet
+        delay = .1
+        while not self._get_pid():
             self.logger.info('Waiting for application to start.')
+            sleep(delay)
+            delay = min(delay * 2, 1.6)
 
         self.logger.info('Application started.')
 
+    def _start_one(self, serial, package, entrypoint):
+        self.logger.info('Run on {}'.format(serial))
+        buildops.cmd(
+            [
+                *self._adb_prefix,
+                "shell",
+                "am",
+                "start",
+                "-W",
+                "-n",
+                f"{package}/{entrypoint}",
+                "-a",
+                entrypoint,
+            ],
+            cwd=self.buildozer.global_platform_dir,
+            close_fds=False,
+            env=self._serial_environ(serial)
+        )
+
     def cmd_p4a(self, *args):
         '''
         Run p4a commands. Args must come after --, or
@@ -1072,14 +1320,18 @@ class TargetAndroid(Target):
         '''
         self._p4a(["clean_builds"], env=self.buildozer.environ)
         self._p4a(["clean_dists"], env=self.buildozer.environ)
+        _canon.cache_clear()
 
     def _get_package(self):
+        if self._package_name is not None:
+            return self._package_name
         config = self.buildozer.config
         package_domain = config.getdefault('app', 'package.domain', '')
         package = config.get('app', 'package.name')
         if package_domain:
             package = package_domain + '.' + package
-        return package.lower()
+        self._package_name = package.lower()
+        return self._package_name
 
     def _generate_whitelist(self, dist_dir):
         p4a_whitelist = self.buildozer.config.getlist(
@@ -1093,6 +1345,7 @@ class TargetAndroid(Target):
         dist_name = self.buildozer.config.get('app', 'package.name')
         dist_dir = self.get_dist_dir(dist_name)
         config = self.buildozer.config
+        cfg = self._app_cfg
         package = self._get_package()
         version = self.buildozer.get_version()
 
@@ -1105,17 +1358,19 @@ class TargetAndroid(Target):
                 ('android.add_libs_x86', 'x86'),
                 ('android.add_libs_mips', 'mips')):
 
-            patterns = config.getlist('app', config_key, [])
+            patterns = cfg.getlist(config_key, [])
             if not patterns:
                 continue
             if lib_dir not in self._archs:
                 continue
 
             self.logger.debug('Search and copy libs for {}'.format(lib_dir))
+            dest_dir = join(dist_dir, 'libs', lib_dir)
+            buildops.mkdir(dest_dir)
             for fn in buildops.file_matches(patterns):
                 buildops.file_copy(
                     join(self.buildozer.root_dir, fn),
-                    join(dist_dir, 'libs', lib_dir, basename(fn)))
+                    join(dest_dir, basename(fn)))
 
         # update the project.properties libraries references
         self._update_libraries_references(dist_dir)
@@ -1128,166 +1383,159 @@ class TargetAndroid(Target):
             ("--name", config.get('app', 'title')),
             ("--version", version),
             ("--package", package),
-            ("--minsdk", config.getdefault('app', 'android.minapi',
-                                           self.android_minapi)),
-            ("--ndk-api", config.getdefault('app', 'android.minapi',
-                                            self.android_minapi)),
+            ("--minsdk", cfg.getdefault('android.minapi',
+                                        self.android_minapi)),
+            ("--ndk-api", cfg.getdefault('android.minapi',
+                                         self.android_minapi)),
             ("--private", self.buildozer.app_dir),
         ]
 
         # add permissions
-        permissions = config.getlist('app', 'android.permissions', [])
+        permissions = cfg.getlist('android.permissions', [])
         for permission in permissions:
             build_cmd += [("--permission", permission)]
 
         # add features
-        features = config.getlist('app', 'android.features', [])
+        features = cfg.getlist('android.features', [])
         for feature in features:
             build_cmd += [("--feature", feature)]
 
         # add res_xml
-        xmlfiles = config.getlist('app', 'android.res_xml', [])
+        xmlfiles = cfg.getlist('android.res_xml', [])
         for xmlfile in xmlfiles:
             build_cmd += [("--res_xml", join(self.buildozer.root_dir,
                                                     xmlfile))]
 
         # android.entrypoint
-        entrypoint = config.getdefault('app', 'android.entrypoint', 'org.kivy.android.PythonActivity')
+        entrypoint = cfg.getdefault('android.entrypoint', 'org.kivy.android.PythonActivity')
         build_cmd += [('--android-entrypoint', entrypoint)]
 
         # android.apptheme
-        apptheme = config.getdefault('app', 'android.apptheme', '@android:style/Theme.NoTitleBar')
+        apptheme = cfg.getdefault('android.apptheme', '@android:style/Theme.NoTitleBar')
         build_cmd += [('--android-apptheme', apptheme)]
 
         # android.compile_options
-        compile_options = config.getlist('app', 'android.add_compile_options', [])
+        compile_options = cfg.getlist('android.add_compile_options', [])
         for option in compile_options:
             build_cmd += [('--add-compile-option', option)]
 
         # android.add_gradle_repositories
-        repos = config.getlist('app', 'android.add_gradle_repositories', [])
+        repos = cfg.getlist('android.add_gradle_repositories', [])
         for repo in repos:
             build_cmd += [('--add-gradle-repository', repo)]
 
         # android packaging options
-        pkgoptions = config.getlist('app', 'android.add_packaging_options', [])
+        pkgoptions = cfg.getlist('android.add_packaging_options', [])
         for pkgoption in pkgoptions:
             build_cmd += [('--add-packaging-option', pkgoption)]
 
         # meta-data
-        meta_datas = config.getlistvalues('app', 'android.meta_data', [])
+        meta_datas = cfg.getlistvalues('android.meta_data', [])
         for meta in meta_datas:
             key, value = meta.split('=', 1)
             meta = '{}={}'.format(key.strip(), value.strip())
             build_cmd += [("--meta-data", meta)]
 
         # add extra Java jar files
-        add_jars = config.getlist('app', 'android.add_jars', [])
+        add_jars = cfg.getlist('android.add_jars', [])
         for pattern in add_jars:
             pattern = join(self.buildozer.root_dir, pattern)
-            matches = glob(expanduser(pattern.strip()))
-            if matches:
-                for jar in matches:
-                    build_cmd += [("--add-jar", jar)]
-            else:
+            jars = [("--add-jar", jar)
+                    for jar in iglob(expanduser(pattern.strip()))]
+            if not jars:
                 raise SystemError('Failed to find jar file: {}'.format(
                     pattern))
+            build_cmd += jars
 
         # add Java activity
-        add_activities = config.getlist('app', 'android.add_activities', [])
+        add_activities = cfg.getlist('android.add_activities', [])
         for activity in add_activities:
             build_cmd += [("--add-activity", activity)]
 
         # add presplash, lottie animation or static
-        presplash = config.getdefault('app', 'android.presplash_lottie', '')
+        presplash = cfg.getdefault('android.presplash_lottie', '')
         if presplash:
             build_cmd += [("--presplash-lottie", join(self.buildozer.root_dir,
                                                       presplash))]
         else:
-            presplash = config.getdefault('app', 'presplash.filename', '')
+            presplash = cfg.getdefault('presplash.filename', '')
             if presplash:
                 build_cmd += [("--presplash", join(self.buildozer.root_dir,
                                                    presplash))]
 
         # add icon
-        icon = config.getdefault('app', 'icon.filename', '')
+        icon = cfg.getdefault('icon.filename', '')
         if icon:
             build_cmd += [("--icon", join(self.buildozer.root_dir, icon))]
-        icon_fg = config.getdefault('app', 'icon.adaptive_foreground.filename', '')
-        icon_bg = config.getdefault('app', 'icon.adaptive_background.filename', '')
+        icon_fg = cfg.getdefault('icon.adaptive_foreground.filename', '')
+        icon_bg = cfg.getdefault('icon.adaptive_background.filename', '')
         if icon_fg and icon_bg:
             build_cmd += [("--icon-fg", join(self.buildozer.root_dir, icon_fg))]
             build_cmd += [("--icon-bg", join(self.buildozer.root_dir, icon_bg))]
 
         # OUYA Console support
-        ouya_category = config.getdefault('app', 'android.ouya.category',
-                                          '').upper()
+        ouya_category = cfg.getdefault('android.ouya.category', '').upper()
         if ouya_category:
             if ouya_category not in ('GAME', 'APP'):
                 raise SystemError(
                     'Invalid android.ouya.category: "{}" must be one of GAME or APP'.format(
                         ouya_category))
             # add icon
-            ouya_icon = config.getdefault('app', 'android.ouya.icon.filename',
-                                          '')
+            ouya_icon = cfg.getdefault('android.ouya.icon.filename', '')
             build_cmd += [("--ouya-category", ouya_category)]
             build_cmd += [("--ouya-icon", join(self.buildozer.root_dir,
                                                ouya_icon))]
 
-        if config.getdefault('app', 'p4a.bootstrap', 'sdl2') != 'service_only':
+        if cfg.getdefault('p4a.bootstrap', 'sdl2') != 'service_only':
             # add orientation
-            orientation = config.getlist('app', 'orientation', ['landscape'])
+            orientation = cfg.getlist('orientation', ['landscape'])
             for orient in orientation:
                 build_cmd += [("--orientation", orient)]
 
             # fullscreen ?
-            fullscreen = config.getbooldefault('app', 'fullscreen', True)
+            fullscreen = cfg.getbooldefault('fullscreen', True)
             if not fullscreen:
                 build_cmd += [("--window", )]
 
         # wakelock ?
-        wakelock = config.getbooldefault('app', 'android.wakelock', False)
+        wakelock = cfg.getbooldefault('android.wakelock', False)
         if wakelock:
             build_cmd += [("--wakelock", )]
 
         # AndroidX ?
-        enable_androidx = config.getbooldefault('app',
-                                                'android.enable_androidx',
-                                                self.android_api > "28")
+        enable_androidx = cfg.getbooldefault('android.enable_androidx',
+                                             self.android_api > "28")
         if enable_androidx:
             build_cmd += [("--enable-androidx", )]
 
         # intent filters
-        intent_filters = config.getdefault(
-            'app', 'android.manifest.intent_filters', '')
+        intent_filters = cfg.getdefault('android.manifest.intent_filters', '')
         if intent_filters:
             build_cmd += [("--intent-filters", join(self.buildozer.root_dir,
                                                     intent_filters))]
 
         # activity launch mode
-        launch_mode = config.getdefault(
-            'app', 'android.manifest.launch_mode', '')
+        launch_mode = cfg.getdefault('android.manifest.launch_mode', '')
         if launch_mode:
             build_cmd += [("--activity-launch-mode", launch_mode)]
 
         # screenOrientation
-        manifest_orientation = config.getdefault(
-            'app', 'android.manifest.orientation', '')
+        manifest_orientation = cfg.getdefault('android.manifest.orientation', '')
         if manifest_orientation:
             build_cmd += [("--manifest-orientation", manifest_orientation)]
 
         # numeric version
-        numeric_version = config.getdefault('app', 'android.numeric_version')
+        numeric_version = cfg.getdefault('android.numeric_version')
         if numeric_version:
             build_cmd += [("--numeric-version", numeric_version)]
 
         # android.allow_backup
-        allow_backup = config.getbooldefault('app', 'android.allow_backup', True)
+        allow_backup = cfg.getbooldefault('android.allow_backup', True)
         if not allow_backup:
             build_cmd += [('--allow-backup', 'false')]
 
         # android.backup_rules
-        backup_rules = config.getdefault('app', 'android.backup_rules', '')
+        backup_rules = cfg.getdefault('android.backup_rules', '')
         if backup_rules:
             build_cmd += [("--backup-rules", join(self.buildozer.root_dir,
                                                   backup_rules))]
@@ -1302,21 +1550,47 @@ class TargetAndroid(Target):
             mode_sign = "release"
             mode = self.get_release_mode()
 
-        self.execute_build_package(build_cmd)
-
-        try:
-            self.buildozer.hook("android_pre_build_apk")
+        # skip p4a when nothing that goes into the artifact has changed
+        build_hash = self._build_hash(build_cmd, dist_dir)
+        artifact_dir, artifact, artifact_dest = self._artifact_paths(
+            dist_dir, mode, mode_sign, version)
+        force_build = self._app_cfg.getbooldefault('android.force_build', False)
+        if (not force_build
+                and self.buildozer.state.get('android:build_hash') == build_hash
+                and exists(join(artifact_dir, artifact))):
+            self.logger.info(
+                'Build inputs unchanged since the last build, reusing {}'.format(
+                    artifact))
+        else:
             self.execute_build_package(build_cmd)
-            self.buildozer.hook("android_post_build_apk")
-        except:
-            # maybe the hook fail because the apk is not
-            pass
-
-        build_tools_versions = os.listdir(join(self.android_sdk_dir, "build-tools"))
-        build_tools_versions = sorted(
-            build_tools_versions, key=packaging.version.parse
-        )
-        build_tools_version = build_tools_versions[-1]
+            artifact_dir, artifact, artifact_dest = self._artifact_paths(
+                dist_dir, mode, mode_sign, version)
+
+        # p4a reported success, but make sure it left the artifact where it
+        # was expected before recording it as the latest build
+        if not exists(join(artifact_dir, artifact)):
+            self.logger.error(
+                'The build finished, but {} was not found in {}'.format(
+                    artifact, artifact_dir))
+            raise BuildozerException()
+
+        # copy to our place
+        buildops.file_copy(
+            join(artifact_dir, artifact),
+            join(self.buildozer.bin_dir, artifact_dest))
+
+        self.logger.info('Android packaging done!')
+        self.logger.info(
+            u'APK {0} available in the bin directory'.format(artifact_dest))
+        self.buildozer.state['android:latestapk'] = artifact_dest
+        self.buildozer.state['android:latestmode'] = self.build_mode
+        self.buildozer.state['android:build_hash'] = build_hash
+
+    def _artifact_paths(self, dist_dir, mode, mode_sign, version):
+        # return (artifact_dir, artifact, artifact_dest): where p4a leaves
+        # the artifact for the dist, and its name in the bin directory
+        config = self.buildozer.config
+        build_tools_version = self._latest_build_tools
         gradle_files = ["build.gradle", "gradle", "gradlew"]
         is_gradle_build = build_tools_version >= "25.0" and any(
             (exists(join(dist_dir, x)) for x in gradle_files))
@@ -1336,11 +1610,7 @@ class TargetAndroid(Target):
 
         else:
             # on ant, the apk use the title, and have version
-            bl = u'\'" ,'
-            apptitle = config.get('app', 'title')
-            if hasattr(apptitle, 'decode'):
-                apptitle = apptitle.decode('utf-8')
-            apktitle = ''.join([x for x in apptitle if x not in bl])
+            apktitle = config.get('app', 'title').translate(self._APKTITLE_STRIP)
             artifact = u'{title}-{version}-{mode}.apk'.format(
                 title=apktitle,
                 version=version,
@@ -1350,42 +1620,88 @@ class TargetAndroid(Target):
         artifact_dest = u'{packagename}-{version}-{arch}-{mode}.{artifact_format}'.format(
             packagename=packagename, mode=mode, version=version,
             arch=self.archs_snake, artifact_format=self.artifact_format)
+        return artifact_dir, artifact, artifact_dest
+
+    def _build_hash(self, build_cmd, dist_dir):
+        # digest of everything the p4a build depends on: the options, the
+        # toolchain (buildozer, p4a, NDK, build-tools and the target API,
+        # which p4a gets from the environment), the signing environment and
+        # the content of the files the options point to. The app dir is
+        # copied afresh for each build, so file contents are hashed rather
+        # than their mtimes.
+        cfg = self._app_cfg
+        state = self.buildozer.state
+        p4a_diff, p4a_untracked = self._p4a_local_changes()
+        h = hashlib.blake2b()
+        h.update(repr((
+            build_cmd, sorted(cfg.items()), self.artifact_format,
+            self.build_mode, self._archs, self.extra_p4a_args,
+            __version__, self.android_api, self.android_ndk_dir,
+            self.android_ndk_version, self._latest_build_tools,
+            state.get('android:p4a_url_branch'), self._p4a_head(), p4a_diff,
+            sorted((key, value) for key, value in os.environ.items()
+                   if key.startswith('P4A_RELEASE_')),
+        )).encode('utf-8'))
+
+        # p4a create rewrites the python bundles on every build, e.g. when
+        # a requirements.source.* tree changed, so they are inputs too
+        paths = [self.buildozer.app_dir, join(dist_dir, 'libs')]
+        paths.extend(sorted(iglob(join(dist_dir, '_python_bundle*'))))
+        paths.extend(p4a_untracked)
+        # a different key at the same path must give a newly signed artifact
+        keystore = os.environ.get('P4A_RELEASE_KEYSTORE')
+        if keystore and exists(keystore):
+            paths.append(keystore)
+        paths.extend(_canon(value) for name, value in cfg.items()
+                     if name.startswith('requirements.source.'))
+        paths.extend(
+            value for option in build_cmd for value in option[1:]
+            if isinstance(value, str) and os.path.isabs(value))
+        for flag, token, kind, default in self._P4A_FLAG_SPEC:
+            if kind == 'path':
+                value = cfg.getdefault(token, default)
+                if value:
+                    paths.append(_canon(value))
+            elif kind == 'paths':
+                paths.extend(_canon(value) for value in cfg.getlist(token, default))
+        for token in ('android.add_assets', 'android.add_resources'):
+            paths.extend(_canon(value.split(':')[0])
+                         for value in cfg.getlist(token, []))
+        for token in ('android.extra_manifest_xml',
+                      'android.extra_manifest_application_arguments'):
+            value = cfg.getdefault(token, '')
+            if value:
+                paths.append(value)
+        local_recipes = self.get_local_recipes_dir()
+        if local_recipes:
+            paths.append(local_recipes)
 
-        # copy to our place
-        buildops.file_copy(
-            join(artifact_dir, artifact),
-            join(self.buildozer.bin_dir, artifact_dest))
-
-        self.logger.info('Android packaging done!')
-        self.logger.info(
-            u'APK {0} available in the bin directory'.format(artifact_dest))
-        self.buildozer.state['android:latestapk'] = artifact_dest
-        self.buildozer.state['android:latestmode'] = self.build_mode
+        for path in dict.fromkeys(paths):
+            _hash_path(h, path)
+        return h.hexdigest()
 
     def _update_libraries_references(self, dist_dir):
         # ensure the project.properties exist
         project_fn = join(dist_dir, 'project.properties')
 
+        # keep everything but the library references, rewritten below
         if not buildops.file_exists(project_fn):
             content = [
                 'target=android-{}\n'.format(self.android_api),
                 'APP_PLATFORM={}\n'.format(self.android_minapi)]
         else:
             with io.open(project_fn, encoding='utf-8') as fd:
-                content = fd.readlines()
-
-        # extract library reference
+                content = [
+                    line for line in fd
+                    if not line.startswith('android.library.reference.')]
         references = []
-        for line in content[:]:
-            if not line.startswith('android.library.reference.'):
-                continue
-            content.remove(line)
 
         # convert our references to relative path
         app_references = self.buildozer.config.getlist(
             'app', 'android.library_references', [])
-        source_dir = realpath(expanduser(self.buildozer.config.getdefault(
-            'app', 'source.dir', '.')))
+        source_dir = _canon(self.buildozer.config.getdefault(
+            'app', 'source.dir', '.'))
+        canon_dist_dir = _canon(dist_dir)
         for cref in app_references:
             # get the full path of the current reference
             ref = realpath(join(source_dir, cref))
@@ -1395,21 +1711,19 @@ class TargetAndroid(Target):
                         cref))
                 sys.exit(1)
             # get a relative path from the project file
-            ref = relpath(ref, realpath(expanduser(dist_dir)))
+            ref = relpath(ref, canon_dist_dir)
             # ensure the reference exists
             references.append(ref)
 
         # recreate the project.properties
-        with io.open(project_fn, 'w', encoding='utf-8') as fd:
-
-            try:
-                fd.writelines((line.decode('utf-8') for line in content))
-            except:
-                fd.writelines(content)
+        tmp_fn = project_fn + '.tmp'
+        with io.open(tmp_fn, 'w', encoding='utf-8') as fd:
+            fd.writelines(content)
             if content and not content[-1].endswith(u'\n'):
                 fd.write(u'\n')
             for index, ref in enumerate(references):
                 fd.write(u'android.library.reference.{}={}\n'.format(index + 1, ref))
+        os.replace(tmp_fn, project_fn)
 
         self.logger.debug('project.properties updated')
 
@@ -1421,8 +1735,9 @@ class TargetAndroid(Target):
         if serial:
             return serial.split(',')
         lines = buildops.cmd(
-            [self.adb_executable, *self.adb_args, "devices"],
+            [*self._adb_prefix, "devices"],
             get_stdout=True,
+            close_fds=False,
             env=self.buildozer.environ
         ).stdout.splitlines()
         serials = []
@@ -1451,7 +1766,8 @@ class TargetAndroid(Target):
             sys.stderr.write(self.adb_executable + '\n')
         else:
             buildops.cmd(
-                [self.adb_executable, *self.adb_args, *args],
+                [*self._adb_prefix, *args],
+                close_fds=False,
                 env=self.buildozer.environ)
 
     def cmd_deploy(self, *args):
@@ -1471,32 +1787,82 @@ class TargetAndroid(Target):
             self.logger.error(
                 'Unable to found the latest APK. Please run "debug" again.')
 
-        # push on the device
-        for serial in self.serials:
-            self.buildozer.environ['ANDROID_SERIAL'] = serial
-            self.logger.info('Deploy on {}'.format(serial))
-            buildops.cmd(
-                [self.adb_executable, *self.adb_args, "install", "-r", full_apk],
-                cwd=self.buildozer.global_platform_dir,
-                env=self.buildozer.environ
-            )
-        self.buildozer.environ.pop('ANDROID_SERIAL', None)
+        # push on the devices, all at once
+        self._on_each_serial(self._install_one, full_apk)
 
         self.logger.info('Application pushed.')
 
+    def _on_each_serial(self, func, *args):
+        serials = self.serials
+        if not serials:
+            return
+        with ThreadPoolExecutor(max_workers=min(8, len(serials))) as executor:
+            futures = [executor.submit(func, serial, *args) for serial in serials]
+            for future in futures:
+                future.result()
+
+    def _serial_environ(self, serial):
+        env = self.buildozer.environ.copy()
+        env['ANDROID_SERIAL'] = serial
+        return env
+
+    def _install_one(self, serial, full_apk):
+        self.logger.info('Deploy on {}'.format(serial))
+        buildops.cmd(
+            [*self._adb_prefix, "install", "-r", full_apk],
+            cwd=self.buildozer.global_platform_dir,
+            close_fds=False,
+            env=self._serial_environ(serial)
+        )
+
+    @cached_property
+    def _adb_prefix(self):
+        # only valid once check_requirements has located adb
+        return (self.adb_executable, *self.adb_args)
+
+    @cached_property
+    def _pidof_cmd(self):
+        # polled by cmd_run until the app is up, so build it only once
+        return (*self._adb_prefix, "shell", "pidof", "-s", self._get_package())
+
+    @cached_property
+    def _logcat_filters(self):
+        filters = self.buildozer.config.getlist(
+            "app",
+            "android.logcat_filters",
+            default=DEFAULT_LOGCAT_FILTERS,
+            section_sep=":",
+            strip=False)
+        return tuple(filters)
+
+    @cached_property
+    def _logcat_cmd(self):
+        if not self.buildozer.config.getbooldefault(
+                'app', 'android.logcat_pid_only', False):
+            return (*self._adb_prefix, "logcat", *self._logcat_filters)
+        # a single adb shell looks the pid up on the device, runs logcat for
+        # it and stops once the app is gone; without a running app this
+        # falls back to the unfiltered log
+        script = (
+            'pid=$(pidof -s {package}); '
+            'if [ -z "$pid" ]; then exec logcat {filters}; fi; '
+            'logcat {filters} --pid=$pid & LOGCAT=$!; '
+            'while [ -d /proc/$pid ]; do sleep 1; done; '
+            'kill $LOGCAT'
+        ).format(
+            package=shlex.quote(self._get_package()),
+            filters=" ".join(shlex.quote(f) for f in self._logcat_filters))
+        return (*self._adb_prefix, "shell", script)
+
     def _get_pid(self):
         pid = buildops.cmd(
-            [
-                self.adb_executable,
-                *self.adb_args,
-                "shell",
-                "pidof",
-                self._get_package(),
-            ],
+            self._pidof_cmd,
             get_stdout=True,
             show_output=False,
             break_on_error=False,
             quiet=True,
+            close_fds=False,
+            stderr_file=DEVNULL,
             env=self.buildozer.environ
         ).stdout
         if pid:
@@ -1506,38 +1872,24 @@ class TargetAndroid(Target):
     def cmd_logcat(self, *args):
         '''Show the log from the device
         '''
+        if self.buildozer.config.getbooldefault(
+                'app', 'android.logcat_disabled', False):
+            return
         self.check_requirements()
-        serial = self.serials[0:]
-        if not serial:
+        if not self.serials:
             return
-        filters = self.buildozer.config.getlist(
-            "app",
-            "android.logcat_filters",
-            default="",
-            section_sep=":",
-            strip=False)
-        filters = " ".join(filters)
-        self.buildozer.environ['ANDROID_SERIAL'] = serial[0]
-        extra_args = []
-        pid = None
-        if self.buildozer.config.getdefault('app', 'android.logcat_pid_only'):
-            pid = self._get_pid()
-            if pid:
-                extra_args.extend(('--pid', pid))
-
         buildops.cmd(
-            [self.adb_executable, *self.adb_args, "logcat", filters, *extra_args],
+            self._logcat_cmd,
             cwd=self.buildozer.global_platform_dir,
             show_output=True,
-            run_condition=self._get_pid if pid else None,
             break_on_error=False,
-            env=self.buildozer.environ
+            stdout_file=sys.stdout,
+            stderr_file=sys.stderr,
+            env=self._serial_environ(self.serials[0])
         )
 
         self.logger.info(f"{self._get_package()} terminated")
 
-        self.buildozer.environ.pop('ANDROID_SERIAL', None)
-
 
 def get_target(buildozer):
     buildozer.targetname = "android"
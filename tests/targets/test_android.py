@@ -4,10 +4,13 @@ import tempfile
 from io import StringIO
 from unittest import mock
 import sys
+import time
 
 import pytest
 
-from buildozer.targets.android import TargetAndroid
+from buildozer.exceptions import BuildozerException
+from buildozer.libs.version import parse
+from buildozer.targets.android import TargetAndroid, _find_install_reqs
 from tests.targets.utils import (
     init_buildozer,
     patch_buildops_checkbin,
@@ -39,7 +42,14 @@ def patch_target_android(method):
 
 
 def patch_platform(platform):
-    return mock.patch("buildozer.targets.android.platform", platform)
+    return mock.patch.multiple(
+        "buildozer.targets.android",
+        platform=platform,
+        _IS_WIN=platform in ("win32", "cygwin"),
+        _IS_DARWIN=platform == "darwin",
+        _IS_LINUX=platform.startswith("linux"),
+        _IS_FREEBSD=platform.startswith("freebsd"),
+    )
 
 
 def init_target(temp_dir, options=None):
@@ -61,9 +71,13 @@ def call_build_package(target_android):
         '{buildozer_dir}/android/platform/build-arm64-v8a_armeabi-v7a/dists/myapp'.format(
         buildozer_dir=buildozer.buildozer_dir)
     )
+    # the artifact p4a would have produced
+    os.makedirs(os.path.join(expected_dist_dir, 'bin'), exist_ok=True)
+    open(os.path.join(expected_dist_dir, 'bin', 'MyApplication-0.1-debug.apk'), 'w').close()
 
     with patch_target_android('_update_libraries_references') as m_update_libraries_references, \
          patch_target_android('_generate_whitelist') as m_generate_whitelist, \
+         patch_target_android('_p4a_head'), \
          mock.patch('buildozer.targets.android.TargetAndroid.execute_build_package') as m_execute_build_package, \
          mock.patch('buildozer.targets.android.buildops.file_copy') as m_copyfile, \
          mock.patch('buildozer.targets.android.os.listdir') as m_listdir:
@@ -127,6 +141,24 @@ class TestTargetAndroid:
             TargetAndroid()
         assert ex_info.value.args[-1].endswith("__init__() missing 1 required positional argument: 'buildozer'")
 
+    def test_p4a_recommended_android_ndk(self):
+        """The recommended NDK is read from p4a and cached in the state."""
+        p4a_dir = os.path.join(self.temp_dir.name, "p4a")
+        os.makedirs(os.path.join(p4a_dir, "pythonforandroid"))
+        rec_file = os.path.join(p4a_dir, "pythonforandroid", "recommendations.py")
+        with open(rec_file, "w") as f:
+            f.write("MIN_NDK_VERSION = 19\nRECOMMENDED_NDK_VERSION = \"25b\"\n")
+        target_android = init_target(self.temp_dir, {"p4a.source_dir": p4a_dir})
+        assert target_android.p4a_recommended_android_ndk == "25b"
+        assert target_android.buildozer.state["android:p4a_recommended_ndk"] == [
+            rec_file, os.path.getmtime(rec_file), "25b"]
+
+        # a new target reuses the cached value without reading the file
+        target_android = TargetAndroid(target_android.buildozer)
+        with mock.patch("buildozer.targets.android.open") as m_open:
+            assert target_android.p4a_recommended_android_ndk == "25b"
+        assert m_open.call_count == 0
+
     def test_sdkmanager(self):
         """Tests the _sdkmanager() method."""
         target_android = init_target(self.temp_dir)
@@ -196,8 +228,11 @@ class TestTargetAndroid:
         with patch_buildops_file_exists() as m_file_exists, \
                 patch_buildops_download() as m_download, \
                 patch_buildops_file_extract() as m_file_extract, \
+                patch_target_android("_partial_dir") as m_partial_dir, \
+                mock.patch("buildozer.buildops.rename") as m_rename, \
                 patch_platform(platform):
             m_file_exists.return_value = False
+            m_partial_dir.side_effect = lambda target_dir: target_dir + ".partial"
             sdk_dir = target_android._install_android_sdk()
         assert m_file_exists.call_args_list == [
             mock.call(target_android.android_sdk_dir)
@@ -209,12 +244,98 @@ class TestTargetAndroid:
             mock.call(
                 "https://dl.google.com/android/repository/",
                 archive,
-                cwd=mock.ANY,
+                cwd=sdk_dir + ".partial",
+                cancel=None,
             )
         ]
         assert m_file_extract.call_args_list == [
-            mock.call(archive, cwd=mock.ANY, env=mock.ANY)]
+            mock.call(archive, cwd=sdk_dir + ".partial", env=mock.ANY)]
         assert sdk_dir.endswith(".buildozer/android/platform/android-sdk")
+        # only moved into place once unpacked
+        assert m_rename.call_args_list == [mock.call(sdk_dir + ".partial", sdk_dir)]
+
+    def test_android_list_build_tools_versions(self):
+        """The build tools listed by sdkmanager are cached in the state."""
+        sdk_dir = os.path.join(self.temp_dir.name, "sdk")
+        os.makedirs(os.path.join(sdk_dir, "tools", "bin"))
+        open(os.path.join(sdk_dir, "tools", "bin", "sdkmanager"), "w").close()
+        target_android = init_target(self.temp_dir, {"android.sdk_path": sdk_dir})
+        sdkmanager_list = (
+            "Installed packages:\n"
+            "  build-tools;30.0.3 | 30.0.3 | Android SDK Build-Tools 30.0.3\n"
+            "Available Packages:\n"
+            "  build-tools;33.0.1 | 33.0.1 | Android SDK Build-Tools 33.0.1\n"
+            "  platforms;android-31 | 1 | Android SDK Platform 31\n"
+        )
+        with patch_target_android("_sdkmanager") as m_sdkmanager:
+            m_sdkmanager.return_value = (sdkmanager_list, None, 0)
+            versions = target_android._android_list_build_tools_versions()
+            assert target_android._android_list_build_tools_versions() == versions
+        assert versions == [parse("30.0.3"), parse("33.0.1")]
+        assert m_sdkmanager.call_args_list == [mock.call("--list")]
+
+    def test_install_platform(self):
+        """The installers all run, with the NDK after p4a and the packages last."""
+        target_android = init_target(self.temp_dir)
+        calls = []
+        installers = ("_install_p4a", "_install_apache_ant", "_install_android_sdk",
+                      "_install_android_ndk", "_install_android_packages")
+        patchers = [patch_target_android(name) for name in installers]
+        for name, patcher in zip(installers, patchers):
+            patcher.start().side_effect = lambda name=name: calls.append(name)
+        try:
+            with patch_target_android("check_configuration_tokens"), \
+                    patch_target_android("_p4a_have_aab_support"):
+                target_android.install_platform()
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+        assert sorted(calls) == sorted(installers)
+        assert calls.index("_install_p4a") < calls.index("_install_android_ndk")
+        assert calls[-1] == "_install_android_packages"
+
+    def test_install_platform_fails_fast(self):
+        """An installer error cancels the other downloads and waits for them."""
+        target_android = init_target(self.temp_dir)
+        sdk_cancelled = []
+
+        def install_android_sdk():
+            # a download, stopped by the cancel flag
+            sdk_cancelled.append(target_android._install_cancel.wait(5))
+
+        with patch_target_android("_install_p4a_and_android_ndk") as m_p4a, \
+                patch_target_android("_install_apache_ant"), \
+                patch_target_android("_install_android_sdk") as m_sdk, \
+                patch_target_android("_install_android_packages") as m_packages:
+            m_p4a.side_effect = BuildozerException()
+            m_sdk.side_effect = install_android_sdk
+            start_time = time.time()
+            with pytest.raises(BuildozerException):
+                target_android.install_platform()
+        # the sdk installer was stopped, and had finished before the error
+        # was raised
+        assert sdk_cancelled == [True]
+        assert time.time() - start_time < 5
+        assert m_packages.call_count == 0
+        assert target_android._install_cancel is None
+
+    def test_install_android_packages(self):
+        """Missing SDK packages are installed with a single sdkmanager call."""
+        target_android = init_target(self.temp_dir)
+        with patch_buildops_file_exists() as m_file_exists, \
+                patch_target_android("_android_update_sdk") as m_android_update_sdk, \
+                patch_target_android("_android_list_build_tools_versions") as m_list_build_tools, \
+                patch_target_android("_read_version_subdir") as m_read_version_subdir, \
+                patch_target_android("_check_aidl") as m_check_aidl:
+            m_file_exists.return_value = False
+            m_list_build_tools.return_value = [parse("30.0.3"), parse("33.0.1")]
+            m_read_version_subdir.return_value = parse("0")
+            target_android._install_android_packages()
+        assert m_android_update_sdk.call_args_list == [
+            mock.call("platform-tools", "build-tools;33.0.1", "platforms;android-31"),
+            mock.call("--update"),
+        ]
+        assert m_check_aidl.call_args_list == [mock.call(parse("33.0.1"))]
 
     def test_build_package(self):
         """Basic tests for the build_package() method."""
@@ -240,6 +361,87 @@ class TestTargetAndroid:
             )
         ]
 
+    def test_build_package_skips_unchanged_build(self):
+        """p4a is not run again when no build input changed."""
+        target_android = init_target(self.temp_dir)
+        buildozer = target_android.buildozer
+        dist_dir = target_android.get_dist_dir("myapp")
+        os.makedirs(os.path.join(dist_dir, "bin"))
+        os.makedirs(buildozer.app_dir, exist_ok=True)
+        with open(os.path.join(buildozer.app_dir, "main.py"), "w") as fd:
+            fd.write("print('hello')\n")
+        bundle_dir = os.path.join(dist_dir, "_python_bundle__arm64-v8a")
+        os.makedirs(bundle_dir)
+        p4a_head = ["abc123"]
+
+        def execute_build_package(build_cmd):
+            # p4a produces the artifact
+            open(os.path.join(dist_dir, "bin", "MyApplication-0.1-debug.apk"), "w").close()
+
+        def build():
+            with patch_target_android('_update_libraries_references'), \
+                    patch_target_android('_generate_whitelist'), \
+                    patch_target_android('_p4a_head') as m_p4a_head, \
+                    patch_target_android('execute_build_package') as m_execute_build_package, \
+                    mock.patch('buildozer.targets.android.buildops.file_copy'), \
+                    mock.patch('buildozer.targets.android.os.listdir') as m_listdir:
+                m_p4a_head.return_value = p4a_head[0]
+                m_execute_build_package.side_effect = execute_build_package
+                m_listdir.return_value = ['30.0.0-rc2']
+                target_android.build_package()
+            return m_execute_build_package.call_count
+
+        assert build() == 1
+        assert build() == 0
+
+        with open(os.path.join(buildozer.app_dir, "main.py"), "w") as fd:
+            fd.write("print('changed')\n")
+        assert build() == 1
+
+        # p4a create rebuilt a recipe into the python bundle
+        with open(os.path.join(bundle_dir, "module.py"), "w") as fd:
+            fd.write("VALUE = 1\n")
+        assert build() == 1
+
+        p4a_head[0] = "def456"
+        assert build() == 1
+        assert build() == 0
+
+        # a different key at the same keystore path
+        keystore = os.path.join(self.temp_dir.name, "release.keystore")
+        with open(keystore, "w") as fd:
+            fd.write("key1")
+        with mock.patch.dict(os.environ, {"P4A_RELEASE_KEYSTORE": keystore}):
+            assert build() == 1
+            assert build() == 0
+            with open(keystore, "w") as fd:
+                fd.write("key2")
+            assert build() == 1
+
+        # a new default target API
+        target_android.android_api = "99"
+        assert build() == 1
+
+        buildozer.config.set("app", "android.force_build", "True")
+        target_android._app_cfg_snapshot = None
+        assert build() == 1
+
+    def test_build_package_missing_artifact(self):
+        """A build that leaves no artifact fails instead of being recorded."""
+        target_android = init_target(self.temp_dir)
+        buildozer = target_android.buildozer
+        with patch_target_android('_update_libraries_references'), \
+                patch_target_android('_generate_whitelist'), \
+                patch_target_android('_p4a_head'), \
+                patch_target_android('execute_build_package'), \
+                mock.patch('buildozer.targets.android.buildops.file_copy') as m_copyfile, \
+                mock.patch('buildozer.targets.android.os.listdir') as m_listdir, \
+                pytest.raises(BuildozerException):
+            m_listdir.return_value = ['30.0.0-rc2']
+            target_android.build_package()
+        assert m_copyfile.call_args_list == []
+        assert 'android:latestapk' not in buildozer.state
+
     def test_execute_build_package__debug__apk(self):
         """Basic tests for the execute_build_package() method. (in debug mode)"""
         target_android = init_target(self.temp_dir)
@@ -309,6 +511,80 @@ class TestTargetAndroid:
             ], env=mock.ANY)
         ]
 
+    def test_execute_build_package__app_options(self):
+        """execute_build_package() reads the [app] options from one snapshot."""
+        target_android = init_target(self.temp_dir, {
+            "services": "Worker:worker.py, Sync:sync.py",
+            "android.copy_libs": "0",
+            "android.home_app": "yes",
+            "android.display_cutout": "shortEdges",
+            "android.gradle_dependencies": "com.example:lib:1.0",
+        })
+        with patch_target_android("_p4a") as m__p4a, \
+                mock.patch.object(
+                    target_android.buildozer.config, "getdefault") as m_getdefault:
+            target_android.execute_build_package([("debug",)])
+        assert m_getdefault.call_args_list == []
+        assert m__p4a.call_args_list == [
+            mock.call([
+                "apk",
+                "--bootstrap",
+                "sdl2",
+                "--dist_name",
+                "myapp",
+                "--service",
+                "Worker:worker.py",
+                "--service",
+                "Sync:sync.py",
+                "--home-app",
+                "--depend",
+                "com.example:lib:1.0",
+                "--display-cutout=shortEdges",
+                "--arch",
+                "arm64-v8a",
+                "--arch",
+                "armeabi-v7a",
+            ], env=mock.ANY)
+        ]
+
+    def test_execute_build_package__extra_manifest_xml(self):
+        """The extra manifest fragments are passed inline to p4a."""
+        xml_path = os.path.join(self.temp_dir.name, "extra_manifest.xml")
+        with open(xml_path, "w", encoding="utf-8") as fd:
+            fd.write("<uses-feature android:name=\"android.hardware.camera\" />")
+        target_android = init_target(self.temp_dir, {
+            "android.extra_manifest_xml": xml_path,
+        })
+        with patch_target_android("_p4a") as m__p4a:
+            target_android.execute_build_package([("debug",)])
+        cmd = m__p4a.call_args[0][0]
+        index = cmd.index("--extra-manifest-xml")
+        assert cmd[index + 1] == (
+            "<uses-feature android:name=\"android.hardware.camera\" />")
+
+    def test_update_libraries_references(self):
+        """Stale library references are replaced in project.properties."""
+        lib_dir = os.path.join(self.temp_dir.name, "mylib")
+        dist_dir = os.path.join(self.temp_dir.name, "dist")
+        os.makedirs(lib_dir)
+        os.makedirs(dist_dir)
+        project_fn = os.path.join(dist_dir, "project.properties")
+        with open(project_fn, "w", encoding="utf-8") as fd:
+            fd.write("target=android-31\n"
+                     "android.library.reference.1=../old\n"
+                     "APP_PLATFORM=21")
+        target_android = init_target(self.temp_dir, {
+            "source.dir": self.temp_dir.name,
+            "android.library_references": "mylib",
+        })
+        target_android._update_libraries_references(dist_dir)
+        with open(project_fn, encoding="utf-8") as fd:
+            assert fd.read() == (
+                "target=android-31\n"
+                "APP_PLATFORM=21\n"
+                "android.library.reference.1=../mylib\n")
+        assert os.listdir(dist_dir) == ["project.properties"]
+
     def test_numeric_version(self):
         """The `android.numeric_version` config should be passed to `build_package()`."""
         target_android = init_target(self.temp_dir, {
@@ -470,6 +746,163 @@ class TestTargetAndroid:
             cwd=mock.ANY,
             env=mock.ANY) in m_cmd.call_args_list
 
+    def test_install_p4a_skips_satisfied_deps(self):
+        """pip is only run for the p4a dependencies that are not installed."""
+        target_android = init_target(self.temp_dir)
+        os.makedirs(target_android.p4a_dir)
+        target_android.buildozer.state["android:p4a_url_branch"] = [
+            "https://github.com/kivy/python-for-android.git", "master"]
+
+        with patch_buildops_cmd() as m_cmd, mock.patch('buildozer.targets.android.open') as m_open:
+            m_open.return_value = StringIO(
+                'install_reqs = ["pytest", "packaging>=1.0", '
+                '"sh>=1.10; sys_platform==\'nt\'"]')
+            target_android._install_p4a()
+        assert m_cmd.call_args_list == []
+
+        with patch_buildops_cmd() as m_cmd, mock.patch('buildozer.targets.android.open') as m_open:
+            m_open.return_value = StringIO(
+                'install_reqs = ["pytest", "surely-not-installed-dist"]')
+            target_android._install_p4a()
+        assert m_cmd.call_count == 1
+        pip_cmd = m_cmd.call_args[0][0]
+        assert pip_cmd[1:5] == ["-m", "pip", "install", "-q"]
+        assert pip_cmd[-1] == "surely-not-installed-dist"
+        assert "pytest" not in pip_cmd
+
+        # an installed distribution doesn't mean its extras are
+        with patch_buildops_cmd() as m_cmd, mock.patch('buildozer.targets.android.open') as m_open:
+            m_open.return_value = StringIO(
+                'install_reqs = ["pytest", "packaging[extra]"]')
+            target_android._install_p4a()
+        assert m_cmd.call_count == 1
+        pip_cmd = m_cmd.call_args[0][0]
+        assert pip_cmd[-1] == "packaging[extra]"
+        assert "pytest" not in pip_cmd
+
+    def test_find_install_reqs(self):
+        """install_reqs is read from p4a's setup.py, whatever its layout."""
+        setup = (
+            "from setuptools import setup\n"
+            "install_reqs = [\n"
+            "    'appdirs',\n"
+            "    'sh>=1.10; sys_platform!=\"nt\"',\n"
+            "    'extra[a]',\n"
+            "]\n"
+            "setup(install_requires=install_reqs)\n"
+        )
+        assert _find_install_reqs(setup) == [
+            "appdirs", 'sh>=1.10; sys_platform!="nt"', "extra[a]"]
+        assert _find_install_reqs("setup()\n") is None
+
+    def test_install_platform_p4a_url_branch_unchanged(self):
+        """git is not asked for the p4a url/branch if they match the last install."""
+        target_android = init_target(self.temp_dir)
+        os.makedirs(target_android.p4a_dir)
+        target_android.buildozer.state["android:p4a_url_branch"] = [
+            "https://github.com/kivy/python-for-android.git", "master"]
+
+        with patch_buildops_cmd() as m_cmd, mock.patch('buildozer.targets.android.open') as m_open:
+            m_open.return_value = StringIO('install_reqs = []')  # to stub setup.py parsing
+            target_android._install_p4a()
+
+        assert not any(call[0][0][0] == "git" for call in m_cmd.call_args_list)
+
+    def test_p4a_have_aab_support_cached(self):
+        """p4a is only probed for AAB support once per checkout commit."""
+        target_android = init_target(self.temp_dir)
+        with patch_buildops_cmd() as m_cmd, patch_target_android("_p4a") as m_p4a:
+            m_cmd.return_value = mock.Mock(stdout="abc123\n", return_code=0)
+            m_p4a.return_value = mock.Mock(return_code=0)
+            assert target_android._p4a_have_aab_support() is True
+            assert target_android._p4a_have_aab_support() is True
+            assert m_p4a.call_count == 1
+            assert target_android.buildozer.state["android:p4a_aab_support"] == [
+                "abc123", True]
+
+            # a new commit triggers a new probe
+            m_cmd.return_value = mock.Mock(stdout="def456\n", return_code=0)
+            target_android._p4a_have_aab_support()
+            assert m_p4a.call_count == 2
+
+    def test_deploy_on_each_serial(self):
+        """The APK is installed on every device, each with its own serial."""
+        target_android = init_target(self.temp_dir)
+        buildozer = target_android.buildozer
+        target_android.adb_executable = "adb"
+        target_android.adb_args = []
+        target_android._serials = ["serial1", "serial2"]
+        buildozer.state["android:latestapk"] = "myapp.apk"
+        buildozer.state["android:latestmode"] = "debug"
+        with mock.patch.object(buildozer, "prepare_for_build"), \
+                patch_buildops_file_exists() as m_file_exists, \
+                patch_buildops_cmd() as m_cmd:
+            m_file_exists.return_value = True
+            target_android.cmd_deploy()
+        assert sorted(
+            call[1]["env"]["ANDROID_SERIAL"] for call in m_cmd.call_args_list
+        ) == ["serial1", "serial2"]
+        assert all(
+            call[0][0] == ["adb", "install", "-r",
+                           os.path.join(buildozer.bin_dir, "myapp.apk")]
+            for call in m_cmd.call_args_list)
+        assert "ANDROID_SERIAL" not in buildozer.environ
+
+    def test_logcat_disabled(self):
+        """android.logcat_disabled skips logcat before checking requirements."""
+        target_android = init_target(self.temp_dir, {
+            "android.logcat_disabled": "True",
+        })
+        with patch_target_android("check_requirements") as m_check_requirements, \
+                patch_buildops_cmd() as m_cmd:
+            target_android.cmd_logcat()
+        assert m_check_requirements.call_count == 0
+        assert m_cmd.call_count == 0
+
+    def test_logcat(self):
+        """Each logcat filter reaches adb as its own argument."""
+        target_android = init_target(self.temp_dir)
+        target_android.adb_executable = "adb"
+        target_android.adb_args = []
+        target_android._serials = ["serial1"]
+        with patch_target_android("check_requirements"), \
+                patch_buildops_cmd() as m_cmd:
+            target_android.cmd_logcat()
+        assert m_cmd.call_count == 1
+        assert m_cmd.call_args[0][0] == (
+            "adb", "logcat", "-v", "brief", "*:S", "python:D",
+            "PythonActivity:D", "SDL:D", "AndroidRuntime:E")
+        assert m_cmd.call_args[1]["env"]["ANDROID_SERIAL"] == "serial1"
+
+    def test_logcat_pid_only(self):
+        """The app's pid is looked up and logged through a single adb shell."""
+        target_android = init_target(self.temp_dir, {
+            "android.logcat_pid_only": "True",
+        })
+        target_android.adb_executable = "adb"
+        target_android.adb_args = []
+        target_android._serials = ["serial1"]
+        with patch_target_android("check_requirements"), \
+                patch_buildops_cmd() as m_cmd:
+            target_android.cmd_logcat()
+        assert m_cmd.call_count == 1
+        command = m_cmd.call_args[0][0]
+        assert command[:2] == ("adb", "shell")
+        assert "pidof -s org.test.myapp" in command[2]
+        assert "--pid=$pid" in command[2]
+        assert "'*:S' python:D" in command[2]
+        assert m_cmd.call_args[1]["env"]["ANDROID_SERIAL"] == "serial1"
+
+    def test_compile_platform_source_dirs(self):
+        """requirements.source.* options become P4A_*_DIR variables."""
+        target_android = init_target(self.temp_dir, {
+            "requirements.source.kivy": "../../kivy",
+        })
+        with patch_target_android("_p4a") as m__p4a:
+            target_android.compile_platform()
+        assert target_android.buildozer.environ["P4A_kivy_DIR"] == os.path.realpath("../../kivy")
+        assert m__p4a.call_count == 1
+
     def test_orientation(self):
         target_android = init_target(self.temp_dir, {
             "orientation": "portrait,portrait-reverse"
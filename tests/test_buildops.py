@@ -2,11 +2,13 @@ from os import environ, unlink
 from pathlib import Path
 import tarfile
 from queue import Queue
+from subprocess import DEVNULL
+from threading import Event
 from sys import executable, platform
 import time
-from tempfile import TemporaryDirectory
+from tempfile import TemporaryDirectory, TemporaryFile
 from unittest import TestCase, mock, skipIf
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo
 
 from buildozer.exceptions import BuildozerCommandException
 import buildozer.buildops as buildops
@@ -63,6 +65,17 @@ class TestBuildOps(TestCase):
 
             assert buildops.file_exists(base_dir)
 
+    def test_file_matches(self):
+        with TemporaryDirectory() as base_dir:
+            for name in ("a.so", "b.so", "c.txt"):
+                (Path(base_dir) / name).touch()
+
+            matches = buildops.file_matches(
+                [str(Path(base_dir) / "*.so"), " {} ".format(Path(base_dir) / "*.txt")])
+            assert sorted(Path(match).name for match in matches) == [
+                "a.so", "b.so", "c.txt"]
+            assert list(buildops.file_matches([str(Path(base_dir) / "*.jar")])) == []
+
     def test_mkdir_rmdir(self):
         with mock.patch(
             "buildozer.buildops.LOGGER"
@@ -266,8 +279,49 @@ class TestBuildOps(TestCase):
                 assert uncompressed_file.read() == "Text to zip"
             m_logger.reset_mock()
 
-            # Todo: Create a multi-file zip file with permissions.
+            # Create a multi-file zip file with permissions.
             # Show it unpacks.
+            script_path = Path(base_dir) / "bin" / "script.sh"
+            script_path.parent.mkdir()
+            script_path.write_text("#!/bin/sh\n")
+            script_path.chmod(0o755)
+            data_path = Path(base_dir) / "data.txt"
+            data_path.write_text("data")
+            data_path.chmod(0o644)
+            zipfile_path = Path(base_dir) / "multi.zip"
+            setuid_path = Path(base_dir) / "bin" / "setuid.sh"
+            with ZipFile(zipfile_path, "w") as outfile:
+                outfile.write(script_path, arcname="bin/script.sh")
+                outfile.write(data_path, arcname=data_path.name)
+                # Special bits are dropped, as unzip does without -K.
+                setuid_info = ZipInfo("bin/setuid.sh")
+                setuid_info.external_attr = 0o104755 << 16
+                outfile.writestr(setuid_info, "#!/bin/sh\n")
+            unlink(script_path)
+            unlink(data_path)
+            buildops.file_extract(zipfile_path, environ, cwd=base_dir)
+            assert script_path.read_text() == "#!/bin/sh\n"
+            assert data_path.read_text() == "data"
+            if platform != "win32":
+                assert script_path.stat().st_mode & 0o777 == 0o755
+                assert data_path.stat().st_mode & 0o777 == 0o644
+                assert setuid_path.stat().st_mode & 0o7777 == 0o755
+            m_logger.reset_mock()
+
+            # A read-only directory listed before its members still unpacks.
+            readonly_dir = Path(base_dir) / "readonly"
+            zipfile_path = Path(base_dir) / "readonly.zip"
+            with ZipFile(zipfile_path, "w") as outfile:
+                dir_info = ZipInfo("readonly/")
+                dir_info.external_attr = (0o40555 << 16) | 0x10
+                outfile.writestr(dir_info, "")
+                outfile.writestr("readonly/member.txt", "member")
+            buildops.file_extract(zipfile_path, environ, cwd=base_dir)
+            assert (readonly_dir / "member.txt").read_text() == "member"
+            if platform != "win32":
+                assert readonly_dir.stat().st_mode & 0o777 == 0o555
+            readonly_dir.chmod(0o755)
+            m_logger.reset_mock()
 
             # Create a tgz file and untgz it.
             text_file_path = Path(base_dir) / "text_to_tgz.txt"
@@ -391,6 +445,56 @@ class TestBuildOps(TestCase):
         assert "can't open file" in cmd_result.stderr
         assert cmd_result.return_code == 2
 
+        # This command reads its answers from stdin
+        cmd_result = buildops.cmd(
+            [executable, "-c", "print(input() + input())"],
+            environ,
+            get_stdout=True,
+            stdin=b"y\n" * 3,
+        )
+        assert cmd_result.stdout.strip() == "yy"
+        assert cmd_result.return_code == 0
+
+        # This command writes its output straight to a file
+        with TemporaryFile() as output_file:
+            cmd_result = buildops.cmd(
+                [executable, "-c", "print('direct')"],
+                environ,
+                get_stdout=True,
+                stdout_file=output_file,
+            )
+            output_file.seek(0)
+            assert output_file.read().strip() == b"direct"
+        assert tuple(cmd_result) == (None, None, 0)
+
+        # This command's error output is discarded
+        cmd_result = buildops.cmd(
+            [executable, "__thisdoesntexist__"],
+            environ,
+            get_stderr=True,
+            break_on_error=False,
+            stderr_file=DEVNULL,
+        )
+        assert tuple(cmd_result) == (None, None, 2)
+
+        # and this one's standard output
+        cmd_result = buildops.cmd(
+            [executable, "-V"], environ, get_stdout=True, stdout_file=DEVNULL
+        )
+        assert tuple(cmd_result) == (None, None, 0)
+
+        # This command's output never passes through buildozer
+        start_time = time.time()
+        with TemporaryFile() as output_file:
+            cmd_result = buildops.cmd(
+                [executable, "-c", "import time; time.sleep(0.5)"],
+                environ,
+                stdout_file=output_file,
+                stderr_file=output_file,
+            )
+        assert tuple(cmd_result) == (None, None, 0)
+        assert time.time() - start_time < 5
+
         # This command takes 10 seconds. Abort after 2.
         start_time = time.time()
 
@@ -435,6 +539,20 @@ class TestBuildOps(TestCase):
             )
             assert ico_path.exists()
 
+    def test_download_cancelled(self):
+        cancel = Event()
+        cancel.set()
+        with TemporaryDirectory() as download_dir, mock.patch(
+            "buildozer.buildops.urlopen"
+        ) as m_urlopen:
+            m_urlopen.return_value.__enter__.return_value.headers = {}
+            with self.assertRaises(BuildozerCommandException):
+                buildops.download(
+                    "https://github.com/", "favicon.ico", cwd=download_dir,
+                    cancel=cancel,
+                )
+            assert not (Path(download_dir) / "favicon.ico").exists()
+
     def test_checkbin(self):
 
         with mock.patch("buildozer.buildops.exit") as m_exit, mock.patch(
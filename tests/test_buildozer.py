@@ -127,13 +127,18 @@ class TestBuildozer(unittest.TestCase):
         # Mock first run
         with mock.patch('buildozer.buildops.download') as download, \
                 mock.patch('buildozer.buildops.file_extract') as m_file_extract, \
+                mock.patch('buildozer.buildops.rename') as m_rename, \
                 mock.patch('os.makedirs'):
             ant_path = target._install_apache_ant()
+        # unpacked beside the final directory, then moved into place
+        partial_path = my_ant_path + '.partial'
         assert m_file_extract.call_args_list == [
-            mock.call(mock.ANY, cwd='/my/ant/path', env=mock.ANY)]
+            mock.call(mock.ANY, cwd=partial_path, env=mock.ANY)]
         assert ant_path == my_ant_path
         assert download.call_args_list == [
-            mock.call("https://archive.apache.org/dist/ant/binaries/", mock.ANY, cwd=my_ant_path)]
+            mock.call("https://archive.apache.org/dist/ant/binaries/", mock.ANY,
+                      cwd=partial_path, cancel=None)]
+        assert m_rename.call_args_list == [mock.call(partial_path, my_ant_path)]
         # Mock ant already installed
         with mock.patch('buildozer.buildops.file_exists', return_value=True):
             ant_path = target._install_apache_ant()
@@ -154,14 +159,17 @@ class TestBuildozer(unittest.TestCase):
         # and we should get the default android's ndk version of buildozer
         assert ndk_version == DEFAULT_ANDROID_NDK_VERSION
 
+    @mock.patch('buildozer.targets.android.os.path.getmtime', return_value=0.0)
     @mock.patch('buildozer.targets.android.os.path.isfile')
     @mock.patch('buildozer.targets.android.os.path.exists')
     @mock.patch('buildozer.targets.android.open', create=True)
     def test_p4a_recommended_android_ndk_found(
-            self, mock_open, mock_exists, mock_isfile
+            self, mock_open, mock_exists, mock_isfile, mock_getmtime
     ):
         self.set_specfile_log_level(self.specfile.name, 1)
         buildozer = Buildozer(self.specfile.name, 'android')
+        # don't let a value cached by a previous run skip the file read
+        buildozer.state.data.pop('android:p4a_recommended_ndk', None)
         expected_ndk = '19b'
         recommended_line = 'RECOMMENDED_NDK_VERSION = {expected_ndk}\n'.format(
             expected_ndk=expected_ndk)